@@ -25,7 +25,7 @@ def main():
         cont = common.get_container()
         arch = ""
         if cont.name == defs.CONTAINER_NATIVE:
-            arch = str(elf.PROC.arch)
+            arch = str(elf.proc().arch)
             if common.ishostqemu():
                 arch += f"-qemu"
         log.logger.info(f"Running in container {cont.name} {arch}")
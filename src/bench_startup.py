@@ -0,0 +1,115 @@
+#!/usr/bin/python
+'''
+Startup benchmark of the agr cli, the commands that do not build anything must start without running any
+subprocesses and without writing to the disk.
+
+python bench_startup.py [--runs N] [--max-ms MS]
+
+Each run is a fresh interpreter with an empty HOME, subprocess.Popen, os.fork and os.system raise in it, exits
+with 1 if any of the commands calls them, writes to HOME or is slower than --max-ms in median.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SRC_PATH = os.path.dirname(os.path.abspath(__file__))
+COMMANDS = [["--version"],
+            ["container", "get"],
+            ["container", "list"],
+            ["rem", "list"]]
+
+HARNESS = '''
+import json
+import os
+import subprocess
+import sys
+import time
+
+calls = []
+
+
+def forbid(name):
+    def forbidden(*args, **kwargs):
+        calls.append(f"{name}{args[:1]}")
+        raise OSError(f"{name} is called in startup")
+    return forbidden
+
+
+subprocess.Popen = forbid("subprocess.Popen")
+os.fork = forbid("os.fork")
+os.system = forbid("os.system")
+fd = int(sys.argv[2])
+sys.argv = ["agr"] + json.loads(sys.argv[1])
+t1 = time.perf_counter()
+error = None
+try:
+    import agr
+    agr.main()
+except SystemExit as e:
+    if e.code:
+        error = f"exit {e.code}"
+except Exception as e:
+    error = repr(e)
+sys.stdout.flush()
+os.write(fd, json.dumps({"time": time.perf_counter() - t1, "calls": calls, "error": error}).encode())
+'''
+
+
+def run(args, home):
+    r, w = os.pipe()
+    env = os.environ.copy()
+    env["HOME"] = home
+    env["PYTHONPATH"] = SRC_PATH
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    t1 = time.perf_counter()
+    # the result is written to a pipe of its own so that the output of agr does not mix with it
+    p = subprocess.Popen([sys.executable, "-c", HARNESS, json.dumps(args), str(w)], cwd=home, env=env,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, pass_fds=(w,))
+    os.close(w)
+    with os.fdopen(r, "rb") as f:
+        out = f.read()
+    p.wait()
+    total = time.perf_counter() - t1
+    if not out:
+        return {"time": total, "total": total, "calls": [], "error": f"harness failed with {p.returncode}"}
+    result = json.loads(out)
+    result["total"] = total
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AGR startup benchmark")
+    parser.add_argument("--runs", type=int, default=10, help="runs of each command")
+    parser.add_argument("--max-ms", type=float, default=250, help="median limit of import and main in milliseconds")
+    args = parser.parse_args()
+
+    failed = False
+    for command in COMMANDS:
+        with tempfile.TemporaryDirectory() as home:
+            results = [run(command, home) for _ in range(args.runs)]
+            written = os.listdir(home)
+        median = statistics.median([x["time"] for x in results]) * 1000
+        total = statistics.median([x["total"] for x in results]) * 1000
+        calls = sorted(set([y for x in results for y in x["calls"]]))
+        errors = sorted(set([x["error"] for x in results if x["error"]]))
+        print(f"agr {' '.join(command)}: {median:.1f}ms in agr, {total:.1f}ms with the interpreter")
+        for call in calls:
+            print(f"  FAIL: called {call}")
+        for error in errors:
+            print(f"  FAIL: {error}")
+        if written:
+            print(f"  FAIL: wrote {', '.join(written)} to HOME")
+        if median > args.max_ms:
+            print(f"  FAIL: slower than {args.max_ms:.0f}ms")
+        failed = failed or bool(calls or errors or written) or median > args.max_ms
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+'''
+Checks the immutable overlays of the host containers, a build over a set of dependency layers must not see the
+files written over another set, and all of them must see the packages installed without layers.
+
+python check_overlays.py
+
+Works on a fake container in a temporary dir through rootfs.View, without root and systemd-nspawn.
+'''
+import os
+import sys
+import tempfile
+
+from libagr import defs
+from libagr import rootfs
+from libagr.container import host
+
+
+def touch(*parts):
+    path = os.path.join(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w"):
+        pass
+
+
+def main():
+    failed = []
+
+    def check(name, value):
+        print(f"{'ok' if value else 'FAIL'}: {name}")
+        if not value:
+            failed.append(name)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        defs.CONT_PATH = tmp
+        cont = host.Host()
+        cont.scratch_path = cont.immutable_path
+        cont.rotated = True
+        layer_a = os.path.join(cont.layers_path, "a")
+        layer_b = os.path.join(cont.layers_path, "b")
+        touch(cont.rootfs_path, "usr", "lib", "rootfs")
+        touch(layer_a, "usr", "lib", "layer-a")
+        touch(layer_b, "usr", "lib", "layer-b")
+        touch(cont.scratch_path, "usr", "lib", "agrdep")
+        _, upper_a = cont.overlaydirs(cont.scratch_path, [layer_a])
+        _, upper_b = cont.overlaydirs(cont.scratch_path, [layer_b])
+        touch(upper_a, "usr", "lib", "written-a")
+
+        def view(layers):
+            return rootfs.View(cont.rootfs_path, cont.overlaymounts(layers))
+
+        check("layer sets have their own uppers", len(set([cont.scratch_path, upper_a, upper_b])) == 3)
+        check("layer a sees its writes", view([layer_a]).exists("/usr/lib/written-a"))
+        check("layer b does not see the writes over layer a", not view([layer_b]).exists("/usr/lib/written-a"))
+        check("no layers do not see the writes over layer a", not view(None).exists("/usr/lib/written-a"))
+        check("layer b does not see layer a", not view([layer_b]).exists("/usr/lib/layer-a"))
+        check("layer b sees itself and the rootfs", view([layer_b]).exists("/usr/lib/layer-b") and
+              view([layer_b]).exists("/usr/lib/rootfs"))
+        check("layers see the packages installed without layers", view([layer_a]).exists("/usr/lib/agrdep") and
+              view([layer_b]).exists("/usr/lib/agrdep"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+'''
+Differential check of the static srcinfo evaluation on the PKGBUILDs that it got wrong before.
+
+python check_srcinfo.py
+
+Each case is compared to the srcinfo makepkg writes for it and to makepkg itself, so makepkg's srcinfo library
+must be installed, exits with 1 on any mismatch or if the library is missing.
+'''
+import os
+import sys
+import tempfile
+
+from libagr import defs
+from libagr import pkgbuild
+from libagr import srcinfo
+
+
+HEADER = """pkgname=foo
+pkgver=1
+pkgrel=1
+arch=(any)
+package() { :; }
+"""
+
+# makepkg writes a global attribute only if [[ $ref ]] is true, which tests the first element of an array
+BASE = "pkgbase = foo\n\tpkgver = 1\n\tpkgrel = 1\n\tarch = any\n\npkgname = foo\n"
+
+CASES = [("array with an empty first element", HEADER + 'depends=("" bar)\n', BASE),
+         ("array with only an empty element", HEADER + 'makedepends=("")\n', BASE),
+         ("array with an empty first element and more", HEADER + "depends=('' a b)\n", BASE),
+         ("empty array", HEADER + "depends=()\n", BASE),
+         ("empty scalar", HEADER + "pkgdesc=\n", BASE),
+         ("array with an empty element after the first", HEADER + 'depends=(bar "")\n',
+          "pkgbase = foo\n\tpkgver = 1\n\tpkgrel = 1\n\tarch = any\n\tdepends = bar\n\tdepends = \n\n"
+          "pkgname = foo\n")]
+
+
+def main():
+    failed = []
+    parser = pkgbuild.Pkgbuild.parsesrcinfo
+    if not os.path.exists(pkgbuild.SHELL_SRCINFO_LIB):
+        print(f"FAIL: {pkgbuild.SHELL_SRCINFO_LIB} does not exist, can not compare to makepkg")
+        return 1
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, pkgsrc, expected in CASES:
+            ok = False
+            try:
+                evaluated = srcinfo.evaluate(pkgsrc)
+            except srcinfo.NotStatic as e:
+                print(f"FAIL: {name}: not static: {e}")
+            else:
+                interpreted = pkgbuild.srcinfopool().evaluate(pkgsrc, tmp, defs.ENV_GIT)
+                ok = srcinfo.verify(name, *evaluated, *interpreted, parser)
+                ok = srcinfo.verify(name, *evaluated, expected, False, parser) and ok
+                print(f"{'ok' if ok else 'FAIL'}: {name}")
+            if not ok:
+                failed.append(name)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
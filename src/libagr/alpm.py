@@ -0,0 +1,204 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import json
+import os
+import re
+import threading
+
+from libagr import log
+
+
+DBPATH = "/var/lib/pacman"
+PACMANCONF = "/etc/pacman.conf"
+LOCAL_DIR = "local"
+SYNC_DIR = "sync"
+SYNC_EXT = ".db"
+DESC = "desc"
+DEPENDS = "depends"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class AlpmError(Exception):
+    pass
+
+
+class DbEntry:
+    def __init__(self, name, version, provides=None):
+        self.name = name
+        self.version = version
+        self.provides = provides or []
+
+    def __repr__(self):
+        return f"{self.name}={self.version}"
+
+
+def parsedesc(txt, fields=None):
+    # %KEY%\nvalue1\nvalue2\n\n%KEY2%...
+    fields = {} if fields is None else fields
+    key = None
+    for line in txt.split("\n"):
+        if len(line) > 2 and line.startswith("%") and line.endswith("%"):
+            key = line[1:-1]
+            fields[key] = []
+        elif line == "":
+            key = None
+        elif key:
+            fields[key].append(line)
+    return fields
+
+
+def toentry(fields):
+    name = fields.get("NAME")
+    version = fields.get("VERSION")
+    if not name or not version:
+        return
+    return DbEntry(name[0], version[0], fields.get("PROVIDES", []))
+
+
+class Database:
+    def __init__(self, dbpath=DBPATH, conf=PACMANCONF):
+        self.dbpath = dbpath
+        self.conf = conf
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def open(self, path):
+        return open(path, "rb")
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def mtime(self, path):
+        return os.stat(path).st_mtime_ns
+
+    def hostpath(self, path):
+        # path of the file for the libraries that open it themselves
+        return path
+
+    def stamp(self, sync=False):
+        # any transaction touches the local dir, any -Sy touches the db files
+        stamp = [self.conf, self.mtime(self.conf)]
+        if sync:
+            for repo in self.repos():
+                path = self.syncpath(repo)
+                stamp.append([repo, self.mtime(path) if self.exists(path) else None])
+        else:
+            stamp.append(self.mtime(self.localpath))
+        return stamp
+
+    @property
+    def localpath(self):
+        return os.path.join(self.dbpath, LOCAL_DIR)
+
+    def syncpath(self, repo):
+        return os.path.join(self.dbpath, SYNC_DIR, f"{repo}{SYNC_EXT}")
+
+    def repos(self):
+        # repo order in pacman.conf is the order pacman -Si lists the packages
+        repos = []
+        with self.open(self.conf) as f:
+            for line in f.read().decode().split("\n"):
+                match = re.search(r"^\s*\[(.+?)\]", line)
+                if match and match.group(1).lower() != "options" and match.group(1) not in repos:
+                    repos.append(match.group(1))
+        return repos
+
+    def iterlocal(self):
+        for pkgdir in sorted(self.listdir(self.localpath)):
+            descpath = os.path.join(self.localpath, pkgdir, DESC)
+            if not self.exists(descpath):
+                continue
+            with self.open(descpath) as f:
+                entry = toentry(parsedesc(f.read().decode()))
+            if entry:
+                yield entry
+
+    def opentar(self, path):
+        import tarfile
+        with self.open(path) as f:
+            magic = f.read(len(ZSTD_MAGIC))
+        if magic == ZSTD_MAGIC:
+            try:
+                import pyzstd
+            except ImportError:
+                raise AlpmError(f"pyzstd is required to read {path}. Please install python-pyzstd.")
+            return tarfile.open(fileobj=pyzstd.ZstdFile(self.hostpath(path), mode="r"))
+        return tarfile.open(self.hostpath(path), mode="r:*")
+
+    def iterdb(self, path):
+        import tarfile
+        pkgs = {}
+        try:
+            with self.opentar(path) as t:
+                for member in t:
+                    if not member.isfile():
+                        continue
+                    pkgdir, fname = os.path.split(member.name)
+                    if fname not in [DESC, DEPENDS]:
+                        continue
+                    # older db formats keep provides in a seperate depends file
+                    parsedesc(t.extractfile(member).read().decode(), pkgs.setdefault(pkgdir, {}))
+        except (tarfile.TarError, EOFError) as e:
+            raise AlpmError(f"Can not read {path}: {e}")
+        for pkgdir in pkgs:
+            entry = toentry(pkgs[pkgdir])
+            if entry:
+                yield entry
+
+    def itersync(self):
+        for repo in self.repos():
+            path = self.syncpath(repo)
+            if not self.exists(path):
+                log.logger.debug(f"Sync db {path} does not exist")
+                continue
+            for entry in self.iterdb(path):
+                yield entry
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, stamp):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.logger.debug(f"Can not read snapshot {self.path}: {e}")
+            return
+        if data.get("stamp") != stamp:
+            return
+        log.logger.debug(f"Read snapshot {self.path}")
+        return [DbEntry(*x) for x in data.get("entries", [])]
+
+    def write(self, stamp, entries):
+        # the snapshot is only a cache, failing to write it is not an error. the threads of a process may write the
+        # same snapshot at once, each of them writes to a file of its own
+        tmppath = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmppath, "w") as f:
+                json.dump({"stamp": stamp,
+                           "entries": [[x.name, x.version, x.provides] for x in entries]}, f)
+            os.replace(tmppath, self.path)
+        except OSError as e:
+            log.logger.debug(f"Can not write snapshot {self.path}: {e}")
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            return
+        log.logger.debug(f"Write snapshot {self.path}")
+
+    def load(self, stamp, loader):
+        # stamp is None when the db can not be stat'ed, then there is nothing to key the snapshot on
+        entries = None if stamp is None else self.read(stamp)
+        if entries is None:
+            entries = list(loader())
+            if stamp is not None:
+                self.write(stamp, entries)
+        return entries
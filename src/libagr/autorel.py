@@ -19,6 +19,7 @@ import os
 from libagr import elf
 from libagr import log
 from libagr import cmd
+from libagr import pkgbuild
 
 DEP_OK = 0
 DEP_NEW = -1
@@ -83,7 +84,7 @@ def syncsysdeps(container, package, noconfirm=False, agrinstalls=None):
                 sysinstalls.append(dep.pkgname)
     if not sysinstalls:
         return
-    pacmancmd = ["sudo", "pacman", "-S", "--needed"] + sysinstalls
+    pacmancmd = pkgbuild.pacman("-S", "--needed", *sysinstalls)
     if noconfirm:
         pacmancmd.append("--noconfirm")
     if not container.run_interactive(*pacmancmd):
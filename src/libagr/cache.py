@@ -3,10 +3,13 @@ Created on Feb 6, 2024
 
 @author: boogie
 '''
+import threading
 
 
 class Cache:
     cache = {}
+    locks = {}
+    lock = threading.Lock()
 
     @staticmethod
     def item(*args):
@@ -23,9 +26,14 @@ class Cache:
     @staticmethod
     def make(key, retval, *args):
         item = Cache.item(*args)
-        if key not in Cache.cache:
-            Cache.cache[key] = {}
-        Cache.cache[key][item] = True, retval
+        Cache.cache.setdefault(key, {})[item] = True, retval
+
+    @staticmethod
+    def itemlock(key, *args):
+        # one lock per cached call, so concurrent callers wait for the running call instead of repeating it
+        item = Cache.item(*args)
+        with Cache.lock:
+            return Cache.locks.setdefault(key, {}).setdefault(item, threading.RLock())
 
     @staticmethod
     def runonce(func):
@@ -33,7 +41,10 @@ class Cache:
             cachekey = func.__qualname__
             hascache, retval = Cache.has(cachekey, *args)
             if not hascache:
-                retval = func(*args, **kwargs)
-                Cache.make(cachekey, retval, *args)
+                with Cache.itemlock(cachekey, *args):
+                    hascache, retval = Cache.has(cachekey, *args)
+                    if not hascache:
+                        retval = func(*args, **kwargs)
+                        Cache.make(cachekey, retval, *args)
             return retval
         return decorated
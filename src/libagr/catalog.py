@@ -0,0 +1,123 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import json
+import os
+import sqlite3
+import threading
+
+from libagr import cache
+from libagr import defs
+from libagr import git
+from libagr import log
+
+
+class Catalog:
+    def __init__(self, rname):
+        self.rname = rname
+        self.rpath = git.repopath(rname)
+        self.path = os.path.join(defs.CACHE_PATH, rname, defs.CATALOG)
+        self.lock = threading.Lock()
+        self._db = None
+        self._rows = None
+        self._head = None
+        self._treeids = None
+
+    def connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # this is a cache that can be regenerated any time, dont wait for the disk on each write
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute("CREATE TABLE IF NOT EXISTS srcinfo (pkgpath TEXT PRIMARY KEY, treeid TEXT, records TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        return db
+
+    @property
+    def db(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            try:
+                self._db = self.connect()
+            except sqlite3.DatabaseError as e:
+                log.logger.warning(f"Recreating broken catalog {self.path}: {e}")
+                os.remove(self.path)
+                self._db = self.connect()
+        return self._db
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            with self.lock:
+                log.logger.debug(f"Read catalog {self.path}")
+                self._rows = {}
+                for pkgpath, treeid, records in self.db.execute("SELECT pkgpath, treeid, records FROM srcinfo"):
+                    self._rows[pkgpath] = (treeid, records)
+        return self._rows
+
+    @property
+    def treeids(self):
+        head = git.readhead(self.rpath)
+        if self._treeids is None or head != self._head:
+            try:
+                self._treeids = git.treeids(self.rpath)
+            except OSError:
+                self._treeids = {}
+            self._head = head
+        return self._treeids
+
+    def treeid(self, pkgpath):
+        # packages are keyed by their own tree, or by the checked out commit of the submodule they are in
+        treeids = self.treeids
+        parent = pkgpath
+        while True:
+            if parent in treeids:
+                kind, treeid = treeids[parent]
+                if parent == pkgpath and kind == "tree":
+                    return treeid
+                elif kind == "commit":
+                    head = git.readhead(git.repopkgpath(self.rname, parent))
+                    if head:
+                        return f"{head}:{os.path.relpath(pkgpath, parent)}"
+                return
+            if parent in ["", "."]:
+                return
+            parent = os.path.dirname(parent)
+
+    def get(self, pkgpath):
+        row = self.rows.get(pkgpath)
+        if row is None:
+            return
+        treeid = self.treeid(pkgpath)
+        if treeid is None or row[0] != treeid:
+            return
+        return json.loads(row[1])
+
+    def put(self, pkgpath, records):
+        treeid = self.treeid(pkgpath)
+        if treeid is None:
+            return
+        records = json.dumps(records)
+        rows = self.rows
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO srcinfo (pkgpath, treeid, records) VALUES (?, ?, ?)",
+                            (pkgpath, treeid, records))
+            self.db.commit()
+            rows[pkgpath] = (treeid, records)
+        log.logger.debug(f"Write catalog {self.rname}: {pkgpath}")
+
+    def getmeta(self, key):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+
+    def setmeta(self, key, value):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            self.db.commit()
+
+
+@cache.Cache.runonce
+def getcatalog(rname):
+    return Catalog(rname)
@@ -8,15 +8,18 @@ from libagr import defs
 from libagr import repo
 from libagr import git
 from libagr import pkgbuild
+from libagr import store
 from libagr.log import logger
 from libagr.config import CFG
 from libagr.container import common
 from libagr import cmd as agrcmd
 
 
-def iter_path(basepath, expected=None, sudo=False):
+def iter_path(basepath, expected=None, sudo=False, keep=None):
     if os.path.exists(basepath):
         for fname in os.listdir(basepath):
+            if keep and fname in keep:
+                continue
             path = os.path.join(basepath, fname)
             if expected and fname not in expected:
                 logger.info(f"Cleaning {path}")
@@ -39,8 +42,8 @@ def iter_container_path(basepath):
         yield fname
 
 
-def iter_remote_path(basepath):
-    for fname in iter_path(basepath, list(CFG.iterremotes())):
+def iter_remote_path(basepath, keep=None):
+    for fname in iter_path(basepath, list(CFG.iterremotes()), keep=keep):
         yield fname
 
 
@@ -72,17 +75,17 @@ def clean_builds():
 def clean_caches():
     for root in iter_base_path():
         if root == defs.CACHE_PATH_NAME:
-            for remote in iter_remote_path(os.path.join(defs.BASE_PATH, root)):
+            for remote in iter_remote_path(os.path.join(defs.BASE_PATH, root), [defs.PACMAN_CACHE_NAME, defs.JOBSERVER_NAME]):
                 pkgs = []
                 for pkgpath in repo.iterpkgpaths(remote):
                     pkgs.append(pkgbuild.foldername(git.repopkgpath(remote, pkgpath)))
                 basepath = os.path.join(defs.BASE_PATH, root, remote)
-                for cachefile in iter_path(basepath):
+                for cachefile in iter_path(basepath, keep=[defs.CATALOG, f"{defs.CATALOG}-journal"]):
                     fnames = cachefile.split(".")
                     if fnames:
                         fname = ".".join(fnames[:-1])
                         ext = "." + fnames[-1]
-                        if fname in pkgs and ext in [defs.PKGHASH, defs.SRCINFO]:
+                        if fname in pkgs and ext in [defs.PKGHASH, defs.SRCINFO, defs.VCSHASH, defs.FOOTPRINT]:
                             continue
                     path = os.path.join(basepath, cachefile)
                     logger.info(f"Cleaning {path}")
@@ -99,9 +102,10 @@ def clean_remotes():
 def clean_sources():
     for root in iter_base_path():
         if root == defs.SRC_PATH_NAME:
-            for remote in iter_remote_path(os.path.join(defs.BASE_PATH, root)):
+            for remote in iter_remote_path(os.path.join(defs.BASE_PATH, root), [defs.STORE_NAME]):
                 for _pkg in iter_pkg_path(os.path.join(defs.BASE_PATH, root, remote), remote):
                     pass
+            store.gc()
 
 
 def clean_dist():
@@ -12,6 +12,8 @@ from libagr import log
 
 KEY_REMOTES = "remotes"
 KEY_CONTAINER = "container"
+KEY_STRATEGIES = "strategies"
+KEY_SRCSTRATEGIES = "srcstrategies"
 
 
 class Config:
@@ -22,6 +24,10 @@ class Config:
             self.cfg[KEY_REMOTES] = {}
         if not self.cfg.get(KEY_CONTAINER):
             self.cfg[KEY_CONTAINER] = None
+        if not self.cfg.get(KEY_STRATEGIES):
+            self.cfg[KEY_STRATEGIES] = {}
+        if not self.cfg.get(KEY_SRCSTRATEGIES):
+            self.cfg[KEY_SRCSTRATEGIES] = {}
 
     def load(self):
         if os.path.exists(defs.CFG_PATH):
@@ -31,6 +37,7 @@ class Config:
             self.cfg = {}
 
     def save(self):
+        os.makedirs(os.path.dirname(defs.CFG_PATH), exist_ok=True)
         with open(defs.CFG_PATH, "w") as f:
             self.cfg = json.dump(self.cfg, f)
 
@@ -41,7 +48,25 @@ class Config:
         for name in self.cfg[KEY_REMOTES]:
             yield name
 
-    def setremote(self, name, remote, branch=defs.DEF_BRANCH):
+    def getstrategy(self, name):
+        return self.cfg[KEY_STRATEGIES].get(name, defs.STRATEGY_FULL)
+
+    def getsrcstrategy(self, name, pkgname=None):
+        # a package setting overrides the setting of its remote, "" is the key of the remote
+        strategies = self.cfg[KEY_SRCSTRATEGIES].get(name, {})
+        return strategies.get(pkgname, strategies.get("", defs.STRATEGY_FULL))
+
+    def setsrcstrategy(self, name, strategy, pkgnames=None):
+        strategies = self.cfg[KEY_SRCSTRATEGIES].setdefault(name, {})
+        for pkgname in pkgnames or [""]:
+            strategies[pkgname] = strategy
+        self.save()
+
+    def iterremotesrcstrategies(self, name):
+        for pkgname, strategy in self.cfg[KEY_SRCSTRATEGIES].get(name, {}).items():
+            yield pkgname, strategy
+
+    def setremote(self, name, remote, branch=defs.DEF_BRANCH, strategy=defs.STRATEGY_FULL):
         if not branch:
             match = re.search(r"ref\:\s*?(.+?)\s*?HEAD", cmd.run_stdout("git", "ls-remote", "--symref", remote, "HEAD", env=defs.ENV_GIT), re.DOTALL)
             if match:
@@ -50,11 +75,14 @@ class Config:
             log.logger.error(f"Can not get branch for {remote}, please check url or define --branch")
             return
         self.cfg[KEY_REMOTES][name] = (remote, branch)
+        self.cfg[KEY_STRATEGIES][name] = strategy
         self.save()
 
     def delremote(self, name):
         if name in self.cfg[KEY_REMOTES]:
             self.cfg[KEY_REMOTES].pop(name)
+        self.cfg[KEY_STRATEGIES].pop(name, None)
+        self.cfg[KEY_SRCSTRATEGIES].pop(name, None)
         self.save()
 
     def setcontainer(self, name):
@@ -5,7 +5,6 @@ Created on May 8, 2024
 '''
 import os
 import tempfile
-import urllib.request
 
 from libagr.container import host
 from libagr import cmd
@@ -31,7 +30,9 @@ class Alarm64(host.Host):
         self.native_path = os.path.join(self.rootfs_path, "opt", defs.ARCH_X86_64)
         self.qemuconf_path = os.path.join(self.cont_path, "qemu.conf")
         host.Host.__init__(self)
-        cmd.run_interactive("sudo", "mkdir", "-p", self.native_path)
+
+    def mkdirs(self):
+        return host.Host.mkdirs(self) + [self.native_path]
 
     def pacmanconf(self, strap=False):
         def addrepo(conf, repo, strap):
@@ -50,11 +51,11 @@ class Alarm64(host.Host):
         conf = addrepo(conf, "aur", strap)
         return conf
 
-    def process_args(self, *cmd, immutable=True, root=False, hostdir=None, cwd=None, env=None, **kwargs):
-        cmd, kwargs = host.Host.process_args(self, *cmd, immutable=immutable, root=root, hostdir=hostdir, cwd=cwd, env=env, **kwargs)
+    def nspawnargs(self, immutable=True, hostdir=None, layers=None, upper=None):
+        args = host.Host.nspawnargs(self, immutable, hostdir, layers, upper)
         if os.path.exists(self.ldcache):
-            cmd.insert(2, f"--bind-ro={self.ldcache}:/etc/ld.so.cache")
-        return cmd, kwargs
+            args.insert(0, f"--bind-ro={self.ldcache}:/etc/ld.so.cache")
+        return args
 
     def runner(self):
         runner = f"export PATH=/opt/{self.tc_base}/{self.tc_triplet}/bin:$PATH\n"
@@ -110,6 +111,7 @@ class Alarm64(host.Host):
 
         # download and prepare the toolchain
         tc_archive = os.path.join(self.cont_path, "toolchain.tar.gz")
+        import urllib.request
         urllib.request.urlretrieve(self.tc_url, tc_archive)
         cmd.run_interactive("sudo", "tar", "-xf", tc_archive, "-C", os.path.join(self.rootfs_path, "opt"))
 
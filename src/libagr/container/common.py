@@ -3,16 +3,14 @@ Created on May 8, 2024
 
 @author: boogie
 '''
-import platform
 import re
 import os
 from libagr import config
 from libagr import container
-from libagr import cmd
 
 
 def iter_containers(arch=None):
-    arch = arch or platform.uname()[4]
+    arch = arch or os.uname().machine
     for cont in container.CONTAINERS:
         if cont.host_archs is None or arch in cont.host_archs:
             yield cont
@@ -36,5 +34,6 @@ def get_container(name=None):
 
 
 def ishostqemu():
-    out = cmd.run_stdout("ps", "-q", str(os.getpid()), "-o", "cmd=")
+    with open(f"/proc/{os.getpid()}/cmdline", "rb") as f:
+        out = f.read().replace(b"\x00", b" ").decode(errors="replace")
     return bool(re.search(r"qemu-.+-static", out))
@@ -4,58 +4,276 @@ Created on May 8, 2024
 @author: boogie
 '''
 import argparse
-import configparser
+import atexit
+import hashlib
 import io
+import json
+import pwd
 import re
 import os
+import subprocess
+import threading
+import time
 
 from libagr.container import native
+from libagr import alpm
 from libagr import cmd as agrcmd
 from libagr import defs
 from libagr import log
 from libagr import elf
+from libagr import rootfs
+from libagr import tmpfs
+
+
+SESSION_TIMEOUT = 30
+NSPAWN_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin"
+RO_BINDS = ["/etc/group", "/etc/passwd", "/etc/shadow"]
+TRASH_EXT = ".trash."
+
+
+def baseenv(root=False):
+    # the environment systemd-nspawn prepares for the user, it does not read any environment files
+    user = pwd.getpwuid(0 if root else os.getuid())
+    return {"PATH": NSPAWN_PATH,
+            "HOME": user.pw_dir,
+            "USER": user.pw_name,
+            "LOGNAME": user.pw_name,
+            "SHELL": user.pw_shell,
+            "TERM": os.environ.get("TERM", "dumb"),
+            "container": "systemd-nspawn"}
+
+
+class Session:
+    # a container that is booted once and kept running with a dummy init, so the commands are executed in it
+    # with nsenter instead of paying a new systemd-nspawn for each of them
+    def __init__(self, name, nspawnargs):
+        self.machine = re.sub(r"[^a-zA-Z0-9\-]", "-", f"agr-{name}-{os.getpid()}")
+        self.nspawnargs = nspawnargs
+        self.process = None
+        self.leader = None
+
+    def start(self):
+        log.logger.debug(f"Starting container session {self.machine}")
+        sysenv = native.Native.env.copy()
+        sysenv["SYSTEMD_SECCOMP"] = "0"
+        try:
+            self.process = subprocess.Popen(["sudo", "systemd-nspawn", *self.nspawnargs, f"--machine={self.machine}",
+                                             "--kill-signal=SIGKILL", "sleep", "infinity"],
+                                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL, env=sysenv)
+            t1 = time.time()
+            while time.time() - t1 < SESSION_TIMEOUT and self.process.poll() is None:
+                p = subprocess.run(["machinectl", "show", self.machine, "--property=Leader", "--value"],
+                                   stdin=subprocess.DEVNULL, capture_output=True, text=True)
+                if p.returncode == 0 and p.stdout.strip().isdigit():
+                    self.leader = p.stdout.strip()
+                    log.logger.debug(f"Started container session {self.machine} in {time.time() - t1:.2f} seconds")
+                    return True
+                time.sleep(0.1)
+        except OSError as e:
+            log.logger.debug(f"Container session {self.machine} failed: {e}")
+        log.logger.warning(f"Can not start container session {self.machine}, falling back to systemd-nspawn per command")
+        self.stop()
+        return False
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            log.logger.debug(f"Stopping container session {self.machine}")
+            try:
+                agrcmd.run_stdout("sudo", "machinectl", "terminate", self.machine)
+            except OSError:
+                pass
+            self.process.wait()
+        self.process = None
+        self.leader = None
+
+    def execargs(self, root, cwd, env):
+        user = pwd.getpwuid(0 if root else os.getuid())
+        cmdenv = baseenv(root)
+        cmdenv.update(env)
+        args = ["sudo", "nsenter", f"--target={self.leader}", "--all", "--root", "--wd", "--"]
+        if not root:
+            args += ["setpriv", f"--reuid={user.pw_uid}", f"--regid={user.pw_gid}", "--init-groups"]
+        args += ["env", "-i", f"--chdir={cwd or user.pw_dir}"]
+        args += [f"{k}={v}" for k, v in cmdenv.items()]
+        return args
 
 
 class Host(native.Native):
-    cont_arch = elf.PROC.arch
-    host_archs = [elf.PROC.arch]
-    name = f"host-{cont_arch}"
+    cont_arch = elf.ProcArch()
+    host_archs = elf.ProcArch(lambda arch: [arch])
+    name = elf.ProcArch(lambda arch: f"host-{arch}")
     packages = native.Native.packages + ["arch-install-scripts", "systemd"]
     cppflags = []
     cflags = []
     cxxflags = []
     ldflags = []
+    # systemd-nspawn locks the rootfs, only one build can run in the container
+    maxjobs = 1
+    # run the commands in a container started once per agr run
+    usesession = True
 
     def __init__(self):
-        self.checkpkgs(self.parsepacman(agrcmd.run_stdout("pacman", "-Qi")))
         # init dirs for container
         self.cont_path = os.path.join(defs.CONT_PATH, self.name)
         self.rootfs_path = os.path.join(self.cont_path, self.name)
         self.immutable_path = os.path.join(self.cont_path, "immutable")
         self.mutable_path = os.path.join(self.cont_path, "mutable")
+        self.layers_path = os.path.join(self.cont_path, "layers")
         self.runner_path = os.path.join(self.cont_path, "autoexec.sh")
         self.pacmanconf_path = os.path.join(self.cont_path, "pacman.conf")
         self.pacstrapconf_path = os.path.join(self.cont_path, "pacstrap.conf")
         self.makepkgconf_path = os.path.join(self.cont_path, "makepkg.conf")
         self.sudoers_path = os.path.join(self.cont_path, "sudoall")
-        os.makedirs(self.cont_path, exist_ok=True)  # create with logged in user
-        agrcmd.run_interactive("sudo", "mkdir", "-p", self.rootfs_path)  # create with root
         self.immutables = ["/boot", "/etc", "/mnt", "/opt", "/root", "/srv", "/usr", "/var"]
         self.mutables = ["/var/cache/pacman"]
-        mkdirs = []
-        rms = []
-        for immutable in self.immutables:
-            mkdirs.append(f"{self.immutable_path}{immutable}")
-            rms.append(f"{self.immutable_path}{immutable}/")
-        for mutable in self.mutables:
-            mkdirs.append(f"{self.mutable_path}{mutable}")
-        agrcmd.run_interactive("sudo", "mkdir", "-p", *mkdirs)
-        agrcmd.run_interactive("sudo", "rm", "-rf", *rms)
+        self.prepared = False
+        self.rotated = False
+        self.preparelock = threading.RLock()
         self._installed = None
         self._available = None
         self._update = None
         self._env = None
         self._pkgext = None
+        self.sessions = {}
+        self.sessionlock = threading.Lock()
+        self.layerlock = threading.Lock()
+        self.scratch_path = None
+        self.scratchbudget = None
+        self.scratchreserved = 0
+        self.footprint_path = os.path.join(self.cont_path, f"immutable{defs.FOOTPRINT}")
+        atexit.register(self.close)
+
+    def checkhost(self):
+        # the host packages only change with a pacman transaction on the host, shares the snapshot of native
+        cachepath = os.path.join(defs.PACMAN_CACHE_PATH, f"{defs.CONTAINER_NATIVE}-local.json")
+        db = alpm.Database()
+        try:
+            stamp = db.stamp()
+        except OSError as e:
+            log.logger.debug(f"Can not stamp pacman db of the host: {e}")
+            stamp = None
+        self.checkpkgs(self.indexpacman(alpm.Snapshot(cachepath).load(stamp, lambda: self.readpacman(False, db))))
+
+    def mkdirs(self):
+        # dirs that must be created by root
+        return [self.rootfs_path, self.immutable_path] + [f"{self.mutable_path}{x}" for x in self.mutables]
+
+    def rotate(self):
+        # the immutable uppers of the previous run are renamed away, which is atomic and needs no root since the
+        # parent is owned by the user, and they are deleted in the background
+        with self.preparelock:
+            if self.rotated:
+                return
+            if os.path.exists(self.immutable_path):
+                trash_path = f"{self.immutable_path}{TRASH_EXT}{time.time_ns()}"
+                log.logger.debug(f"Rotating {self.immutable_path} to {trash_path}")
+                os.rename(self.immutable_path, trash_path)
+            self.rotated = True
+        self.emptytrash()
+
+    def emptytrash(self):
+        if not os.path.exists(self.cont_path):
+            return
+        prefix = f"{os.path.basename(self.immutable_path)}{TRASH_EXT}"
+        trash = [os.path.join(self.cont_path, x) for x in os.listdir(self.cont_path) if x.startswith(prefix)]
+        if trash:
+            # -n, so that it never waits for a password, whatever is left is deleted on the next run
+            log.logger.debug(f"Deleting {' '.join(trash)} in the background")
+            try:
+                subprocess.Popen(["sudo", "-n", "rm", "-rf", *trash],
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                 start_new_session=True)
+            except OSError as e:
+                log.logger.debug(f"Can not delete {' '.join(trash)}: {e}")
+
+    def prepare(self):
+        # done once before the first command runs in the container instead of when the container object is created
+        with self.preparelock:
+            if self.prepared:
+                return
+            self.checkhost()
+            os.makedirs(self.cont_path, exist_ok=True)  # create with logged in user
+            self.rotate()
+            mkdirs = [x for x in self.mkdirs() if not os.path.isdir(x)]
+            if mkdirs:
+                agrcmd.run_interactive("sudo", "mkdir", "-p", *mkdirs)  # create with root
+            self.prepared = True
+
+    @property
+    def scratch(self):
+        # the immutable uppers only live for this run, they are moved to tmpfs if their footprint in the previous
+        # run fits the budget of the builds. commands run before the budget starts leave them on the disk, they are
+        # decided again when it starts unless something is written to them already
+        with self.preparelock:
+            budget = tmpfs.budget()
+            if self.scratch_path is not None and budget and self.scratchbudget is None and not self.isscratchempty():
+                # stays on the disk, its footprint is still measured for the next run
+                self.scratchbudget = budget
+            if self.scratch_path is None or (budget and self.scratchbudget is None):
+                self.scratch_path = self.immutable_path
+                self.scratchbudget = budget
+                self.scratchreserved = budget.reserve(tmpfs.readfootprint(self.footprint_path)) if budget else 0
+                if self.scratchreserved:
+                    self.scratch_path = os.path.join(self.scratchbudget.path, defs.CONT_PATH_NAME, self.name,
+                                                     os.path.basename(self.immutable_path))
+                    log.logger.debug(f"Immutable uppers of {self.name} are on tmpfs {self.scratch_path}")
+                # it is also a lower dir of the builds over layers, which must exist
+                agrcmd.run_interactive("sudo", "mkdir", "-p", *[f"{self.scratch_path}{x}" for x in self.immutables])
+            return self.scratch_path
+
+    def isscratchempty(self):
+        # the work dirs of the overlays are next to their uppers
+        try:
+            for fname in os.listdir(self.scratch_path):
+                path = os.path.join(self.scratch_path, fname)
+                if not fname.startswith(".#") and (not os.path.isdir(path) or os.listdir(path)):
+                    return False
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+
+    def overlaydirs(self, base, layers=None, upper=None):
+        # lower dirs of the immutable overlays lowest first and their upper. the layers are stacked over the rootfs
+        # and the packages installed without layers over them, the writes of the builds over a set of layers go
+        # to an upper of the set, so that a build never sees what was written over other layers
+        lowers = [self.rootfs_path] + list(layers or [])
+        if upper is None and layers:
+            lowers.append(base)
+            upper = os.path.join(base, "layers", hashlib.md5("\0".join(layers).encode()).hexdigest())
+        return lowers, upper or base
+
+    def overlaymounts(self, layers=None):
+        # immutable overlays as the host dirs layered on them upper first
+        base = self.scratch_path or self.immutable_path
+        lowers, upper = self.overlaydirs(base, layers)
+        dirs = [upper] + lowers[::-1]
+        if not self.rotated:
+            # the uppers of the previous run are rotated away before the first command, the commands never see them
+            dirs = [x for x in dirs if x != base and not x.startswith(f"{base}/")]
+        return {x: [f"{y}{x}" for y in dirs] for x in self.immutables}
+
+    def close(self):
+        self.closesessions()
+        if self.scratchbudget is None:
+            return
+        kept = 0
+        try:
+            size = int(agrcmd.run_stdout("sudo", "-n", "du", "-sb", self.scratch_path).split()[0])
+            tmpfs.writefootprint(self.footprint_path, size)
+            if self.scratchreserved:
+                agrcmd.run_stdout("sudo", "-n", "rm", "-rf", self.scratch_path)
+                kept = size
+                log.logger.info(f"Kept {log.sizeof(size)} of overlay writes of {self.name} off the disk on tmpfs")
+        except (OSError, ValueError, IndexError) as e:
+            log.logger.debug(f"Can not measure {self.scratch_path}: {e}")
+        self.scratchbudget.release(self.scratchreserved, kept)
+        self.scratchbudget = None
+        self.scratchreserved = 0
 
     def update(self, noconfirm=False):
         if not self._update:
@@ -64,46 +282,45 @@ class Host(native.Native):
                 pacmancmd.append("--noconfirm")
             self.run_interactive(*pacmancmd, root=True, immutable=False)
             self._update = True
+            self._installed = None
+            self._available = None
 
     @property
-    def installed(self):
-        if self._installed is None:
-            self._installed = self.parsepacman(self.run_stdout("pacman", "-Qi"))
-        return self._installed
-
-    @property
-    def available(self):
-        if self._available is None:
-            self._available = self.parsepacman(self.run_stdout("pacman", "-Si"), 1)
-        return self._available
+    def pacmandb(self):
+        return rootfs.Database(self.view())
 
     @property
     def env(self):
         if self._env is None:
-            self._env = {}
-            try:
-                envtxt = self.run_stdout("printenv")
-                pass
-            except OSError:
-                envtxt = ""
-                pass
-            for envline in envtxt.split("\n"):
-                splits = envline.split("=")
-                if len(splits) > 2:
-                    splits = [splits[0], "=".join(splits[1:])]
-                if len(splits) == 2 and splits[0] not in defs.SKIPENV:
-                    self._env[splits[0]] = splits[1]
+            self._env = baseenv()
             for k, v in native.Native.env.items():
-                if k not in self.env:
+                if k not in self._env:
                     self._env[k] = v
         return self._env.copy()
 
+    @property
+    def pkgext(self):
+        if self._pkgext is None:
+            view = self.view()
+            confs = ["/etc/makepkg.conf"]
+            try:
+                confs += [f"/etc/makepkg.conf.d/{x}" for x in view.listdir("/etc/makepkg.conf.d") if x.endswith(".conf")]
+            except OSError:
+                pass
+            src = ""
+            for conf in confs:
+                with view.open(conf, "r") as f:
+                    src += f.read() + "\n"
+            src += "printf $PKGEXT"
+            self._pkgext = agrcmd.run_stdout("bash", "-c", src)
+        return self._pkgext
+
     def makepkgconf(self, actual):
+        # MAKEFLAGS is left as is, the builds get theirs from the jobserver
         changes = {"CPPFLAGS": " ".join(self.cppflags) if self.cppflags else None,
                    "CFLAGS": " ".join(self.cflags) if self.cflags else None,
                    "CXXFLAGS": " ".join(self.cxxflags) if self.cxxflags else None,
-                   "LDFLAGS": " ".join(self.ldflags) if self.ldflags else None,
-                   "MAKEFLAGS": f"-j{defs.NUMCORES}"}
+                   "LDFLAGS": " ".join(self.ldflags) if self.ldflags else None}
 
         def replacer(m):
             if m is not None:
@@ -120,6 +337,7 @@ class Host(native.Native):
         return actual
 
     def pacmanconf(self, _strap=True):
+        import configparser
         contcfg = configparser.ConfigParser(allow_no_value=True, strict=False)
         contcfg.optionxform = str
         systemcfg = configparser.ConfigParser(allow_no_value=True, strict=False)
@@ -174,6 +392,7 @@ class Host(native.Native):
     def cmd_container(self, report, cmd_cont, name=None, exec=None):
         if not native.Native.cmd_container(self, report, cmd_cont, name):
             if cmd_cont == defs.CMD_CONT_WIPE:
+                self.closesessions()
                 log.logger.info(f"Cleaning {self.cont_path}")
                 agrcmd.run_interactive("sudo", "rm", "-rf", self.cont_path)
                 return True
@@ -187,7 +406,88 @@ class Host(native.Native):
                 self.run_interactive("bash", hostdir=os.getcwd(), immutable=False)
                 return True
 
-    def process_args(self, *cmd, immutable=True, root=False, hostdir=None, cwd=None, env=None, **kwargs):
+    def nspawnargs(self, immutable=True, hostdir=None, layers=None, upper=None):
+        # run in container, map home dir to container so that we can take advantage of ~/.agr folder
+        args = ["-q",
+                f"--bind=/home/{os.getlogin()}",
+                "-D", self.rootfs_path]
+
+        # mount overlay fs to mutable parts of the container so that they will be kept if immutable
+        if immutable:
+            lowers, upper = self.overlaydirs(self.scratch, layers, upper)
+            for overlay in self.immutables:
+                args += f"--overlay={':'.join(f'{x}{overlay}' for x in lowers)}:{upper}{overlay}:{overlay}",
+            for overlay in self.mutables:
+                args += f"--overlay={self.rootfs_path}{overlay}:{self.mutable_path}{overlay}:{overlay}",
+            # args += ["--volatile=overlay"]
+            # args += ["--tmpfs=/"]
+
+        if hostdir:
+            args += ["--bind", hostdir]
+
+        # build dirs on tmpfs, only while the builds of this run have a budget there
+        budget = tmpfs.budget()
+        if budget:
+            args += ["--bind", budget.path]
+
+        # transfer host users to container
+        for ro_bind in RO_BINDS:
+            args += ["--bind-ro", ro_bind]
+
+        # map modified configs to container
+        for conf_cont, conf_host in self.confs.items():
+            if os.path.exists(conf_host):
+                args += ["--bind", f"{conf_host}:/{conf_cont}"]
+        return args
+
+    @property
+    def confs(self):
+        return {"/etc/pacman.conf": self.pacmanconf_path,
+                "/etc/makepkg.conf": self.makepkgconf_path,
+                "/etc/sudoers.d/sudoall": self.sudoers_path}
+
+    def view(self, immutable=True, layers=None):
+        # the files the commands would see in the container, read from the host without starting it
+        home = f"/home/{os.getlogin()}"
+        mounts = {home: [home]}
+        if immutable:
+            mounts.update(self.overlaymounts(layers))
+            for overlay in self.mutables:
+                mounts[overlay] = [f"{self.mutable_path}{overlay}", f"{self.rootfs_path}{overlay}"]
+        for ro_bind in RO_BINDS:
+            mounts[ro_bind] = [ro_bind]
+        for conf_cont, conf_host in self.confs.items():
+            if os.path.exists(conf_host):
+                mounts[conf_cont] = [conf_host]
+        return rootfs.View(self.rootfs_path, mounts)
+
+    def getsession(self, immutable, layers=None, upper=None):
+        # the overlays of an immutable session must not see the rootfs changing under them, and the upper of the
+        # sessions without layers is a lower of the ones with layers, so only one kind of session runs at a time
+        with self.sessionlock:
+            key = immutable, tuple(layers or []), upper, tmpfs.budget() is not None
+            session = self.sessions.get(key)
+            if session is None:
+                self.stopsessions()
+                session = Session(self.name, self.nspawnargs(immutable, None, layers, upper))
+                if not session.start():
+                    self.usesession = False
+                    return
+                self.sessions[key] = session
+            return session
+
+    def stopsessions(self):
+        for session in self.sessions.values():
+            session.stop()
+        self.sessions = {}
+
+    def closesessions(self):
+        with self.sessionlock:
+            self.stopsessions()
+
+    def process_args(self, *cmd, immutable=True, root=False, hostdir=None, cwd=None, env=None, layers=None, upper=None,
+                     **kwargs):
+        self.prepare()
         cmd = list(cmd)
 
         # update reqested env with current env in the host
@@ -199,21 +499,22 @@ class Host(native.Native):
             env = self.env
         log.logger.debug(f"Executing in container: {self.name}: '{' '.join(cmd)}', kwargs: {kwargs}, root: {root}, cwd: {cwd}")
 
-        # run in container, map home dir to container so that we can take advantage of ~/.agr folder
-        precmd = ["sudo",
-                  "systemd-nspawn",
-                  "-q",
-                  f"--bind=/home/{os.getlogin()}",
-                  "-D", self.rootfs_path]
+        # dont do security checks to improve container execution speed
+        sysenv = native.Native.env.copy()
+        sysenv["SYSTEMD_SECCOMP"] = "0"
+        kwargs["env"] = sysenv
 
-        # mount overlay fs to mutable parts of the container so that they will be kept if immutable
-        if immutable:
-            for overlay in self.immutables:
-                precmd += f"--overlay={self.rootfs_path}{overlay}:{self.immutable_path}{overlay}:{overlay}",
-            for overlay in self.mutables:
-                precmd += f"--overlay={self.rootfs_path}{overlay}:{self.mutable_path}{overlay}:{overlay}",
-            # precmd += ["--volatile=overlay"]
-            # precmd += ["--tmpfs=/"]
+        # host dirs are bound when the container starts, so those commands need a container of their own
+        session = None
+        if self.usesession and not hostdir:
+            session = self.getsession(immutable, layers, upper)
+        if session:
+            return session.execargs(root, cwd, env) + [self.runner_path] + cmd, kwargs
+        with self.sessionlock:
+            # systemd-nspawn can not start while a session holds the lock of the rootfs
+            self.stopsessions()
+
+        precmd = ["sudo", "systemd-nspawn"] + self.nspawnargs(immutable, hostdir, layers, upper)
 
         # set login user of container
         if not root:
@@ -222,7 +523,6 @@ class Host(native.Native):
         # set cwd of the container
         if hostdir:
             cwd = hostdir
-            precmd += ["--bind", hostdir]
         if cwd:
             precmd += ["--chdir", cwd]
 
@@ -230,24 +530,8 @@ class Host(native.Native):
         for k, v in env.items():
             precmd += ["-E", f"{k}={v}"]
 
-        # transfer host users to container
-        for ro_bind in ["/etc/group", "/etc/passwd", "/etc/shadow"]:
-            precmd += ["--bind-ro", ro_bind]
-
-        # map modified configs to container
-        confs = {"/etc/pacman.conf": self.pacmanconf_path,
-                 "/etc/makepkg.conf": self.makepkgconf_path,
-                 "/etc/sudoers.d/sudoall": self.sudoers_path}
-        for conf_cont, conf_host in confs.items():
-            if os.path.exists(conf_host):
-                precmd += ["--bind", f"{conf_host}:/{conf_cont}"]
         precmd += [self.runner_path]
 
-        # dont do security checks to improve container execution speed
-        sysenv = native.Native.env.copy()
-        sysenv["SYSTEMD_SECCOMP"] = "0"
-        kwargs["env"] = sysenv
-
         return precmd + cmd, kwargs
 
     def run_interactive(self, *cmd, **kwargs):
@@ -258,7 +542,86 @@ class Host(native.Native):
         cmd, cmdargs = self.process_args(*cmd, **kwargs)
         return agrcmd.run_stdout(*cmd, **cmdargs).replace("\r", "")
 
+    def buildargs(self, pkgb):
+        # the repo dependencies of a build are installed once to a layer, and builds with the same dependencies
+        # stack it under their overlay instead of installing them again
+        if not pkgb.sysdeps:
+            return {}
+        layer = self.getlayer(sorted(f"{x.pkgname}={x.version}" for x in pkgb.sysdeps))
+        if layer is None:
+            return {}
+        return {"layers": [layer]}
+
+    def layerkey(self, deps):
+        # the layer is only valid on the rootfs it was installed on
+        layerhash = hashlib.md5()
+        db = rootfs.Database(rootfs.View(self.rootfs_path))
+        for part in [json.dumps(db.stamp())] + deps:
+            layerhash.update(f"{part}\0".encode())
+        return layerhash.hexdigest()
+
+    def getlayer(self, deps):
+        with self.layerlock:
+            key = self.layerkey(deps)
+            layer_path = os.path.join(self.layers_path, key)
+            meta_path = f"{layer_path}.json"
+            if os.path.exists(layer_path) and os.path.exists(meta_path):
+                log.logger.debug(f"Using layer {key} for {' '.join(deps)}")
+                os.utime(meta_path)
+                return layer_path
+            tmp_path = f"{layer_path}.tmp"
+            log.logger.info(f"Creating dependency layer {key} for {' '.join(deps)}")
+            try:
+                os.makedirs(self.layers_path, exist_ok=True)
+                if os.path.exists(tmp_path):
+                    agrcmd.run_interactive("sudo", "rm", "-rf", tmp_path)
+                os.makedirs(tmp_path)
+                self.run_interactive("pacman", "-S", "--needed", "--asdeps", "--noconfirm",
+                                     *[x.split("=")[0] for x in deps], root=True, upper=tmp_path)
+                # the layer is a lower dir from now on, it must not be mounted as an upper anymore
+                self.closesessions()
+                # a lower dir of an overlay must exist
+                agrcmd.run_interactive("sudo", "mkdir", "-p", *[f"{tmp_path}{x}" for x in self.immutables])
+                size = int(agrcmd.run_stdout("sudo", "du", "-sb", tmp_path).split()[0])
+            except (OSError, ValueError) as e:
+                log.logger.warning(f"Can not create dependency layer {key}, build will install its dependencies: {e}")
+                return
+            os.rename(tmp_path, layer_path)
+            with open(meta_path, "w") as f:
+                json.dump({"size": size, "deps": deps}, f)
+            self.evictlayers(defs.LAYERS_BUDGET, layer_path)
+            return layer_path
+
+    def evictlayers(self, budget, keep=None):
+        # least recently used layers are removed until the rest fit in the budget
+        if not os.path.exists(self.layers_path):
+            return
+        layers = []
+        for fname in os.listdir(self.layers_path):
+            if not fname.endswith(".json"):
+                continue
+            meta_path = os.path.join(self.layers_path, fname)
+            try:
+                with open(meta_path, "r") as f:
+                    size = json.load(f)["size"]
+            except (OSError, ValueError, KeyError):
+                size = 0
+            layers.append((os.stat(meta_path).st_mtime, meta_path[:-len(".json")], size))
+        total = 0
+        for _mtime, layer_path, size in sorted(layers, reverse=True):
+            total += size
+            if total <= budget or layer_path == keep:
+                continue
+            log.logger.info(f"Evicting dependency layer {layer_path}")
+            self.closesessions()
+            agrcmd.run_interactive("sudo", "rm", "-rf", layer_path)
+            os.remove(f"{layer_path}.json")
+
     def create(self):
+        # the rootfs is recreated under the container
+        self.closesessions()
+        self.prepare()
+
         # clean config files as root
         agrcmd.run_stdout("sudo", "rm", "-f", self.pacstrapconf_path, self.pacmanconf_path, self.makepkgconf_path, self.sudoers_path)
 
@@ -4,7 +4,9 @@ Created on May 8, 2024
 @author: boogie
 '''
 import argparse
+import os
 
+from libagr import alpm
 from libagr import pkgbuild
 from libagr import config
 from libagr import repo as agrrepo
@@ -13,6 +15,7 @@ from libagr import defs
 from libagr import git
 from libagr import clean
 from libagr import elf
+from libagr import srcinfo
 from libagr.container import common
 
 from libagr import cmd as agrcmd
@@ -30,22 +33,40 @@ class SplitArgs(argparse.Action):
 class Native:
     name = defs.CONTAINER_NATIVE
     host_archs = None
-    cont_arch = elf.PROC.arch
+    cont_arch = elf.ProcArch()
     makepkgconf_path = "/etc/makepkg.conf"
     packages = ["sudo", "base-devel", "git"]
+    # max number of concurrent builds, None for no limit
+    maxjobs = None
     env = defs.ENV.copy()
-    installed = {}
 
     def __init__(self):
-        self.installed = self.parsepacman(self.run_stdout("pacman", "-Qi"))
-        self.available = self.parsepacman(self.run_stdout("pacman", "-Si"), 1)
-        self.checkpkgs(self.installed)
+        self._installed = None
+        self._available = None
         self._update = False
         self._pkgext = None
 
     def __repr__(self):
         return self.name
 
+    @property
+    def installed(self):
+        if self._installed is None:
+            self._installed = self.indexpacman(self.cachepacman())
+            if self.name == defs.CONTAINER_NATIVE:
+                self.checkpkgs(self._installed)
+        return self._installed
+
+    @property
+    def available(self):
+        if self._available is None:
+            self._available = self.indexpacman(self.cachepacman(True))
+        return self._available
+
+    @property
+    def pacmandb(self):
+        return alpm.Database()
+
     @property
     def pkgext(self):
         if self._pkgext is None:
@@ -67,12 +88,22 @@ class Native:
         rem_set_p.add_argument("uri", help="git compatible uri of the remote repo")
         rem_set_p.add_argument("--branch", default=defs.DEF_BRANCH, required=False,
                                help="use specific branch of the remote repository")
+        rem_set_p.add_argument("--strategy", default=defs.STRATEGY_FULL, required=False, choices=defs.STRATEGIES,
+                               help="clone strategy of the remote and its submodules: full history, shallow (--depth 1), "
+                                    "blobless (--filter=blob:none), or sparse (blobless with only the package dirs checked out)")
 
         rem_del_p = cmd_rem.add_parser(defs.CMD_REM_DEL, help="Delete a remote")
         rem_del_p.add_argument("name", help="name of the repository to delete")
 
         _rem_list_p = cmd_rem.add_parser(defs.CMD_REM_LIST, help="List active list of remote repositories")
 
+        rem_src_p = cmd_rem.add_parser(defs.CMD_REM_SOURCES, help="Set how the git sources of packages are mirrored in SRCDEST")
+        rem_src_p.add_argument("name", help="name of the remote repository")
+        rem_src_p.add_argument("strategy", choices=defs.SRC_STRATEGIES,
+                               help="full mirrors, or blobless (--filter=blob:none) mirrors that fetch only the blobs of the built revision")
+        rem_src_p.add_argument("--pkg", required=False, metavar="pkg1,pkg2,..", action=SplitArgs,
+                               help="set only for the comma seperated list of pkgbases instead of the whole remote")
+
         sync_p = cmd.add_parser(defs.CMD_CONT_SYNC, help="Synchronize remotes, packages and containers")
         update_p = cmd.add_parser(defs.CMD_UPDATE, help="Update packages")
         build_p = cmd.add_parser(defs.CMD_BUILD, help="Build packages")
@@ -89,6 +120,17 @@ class Native:
             install_p.add_argument('pkgname', nargs='+', help="list of packages to build")
             parsers.append(install_p)
 
+        for p in parsers[1:]:
+            p.add_argument("-j", "--jobs", required=False, type=int, default=defs.BUILD_JOBS, metavar="N",
+                           help="Number of independent packages to build concurrently")
+            p.add_argument("--cores", required=False, type=int, default=defs.BUILD_CORES, metavar="N",
+                           help="Number of compile jobs shared by all concurrent builds, through a make jobserver")
+            p.add_argument("--prefetch", required=False, type=int, default=defs.PREFETCH_JOBS, metavar="N",
+                           help="Number of packages to download the sources of, ahead of their builds (0 to disable)")
+            p.add_argument("--tmpfs", required=False, type=int, default=defs.TMPFS_BUDGET, metavar="MiB",
+                           help=f"RAM budget to build on tmpfs at {defs.TMPFS_PATH}, for the packages with a known "
+                                "build footprint that fits (0 to disable)")
+
         for p in [sync_p, update_p]:
             p.add_argument("--pkg", required=False, metavar="pkg1,pkg2,..", action=SplitArgs,
                            help="limit to the only list of comma seperated packages")
@@ -114,6 +156,18 @@ class Native:
                            help="ignore the comma seperated list of pkgs")
 
         update_p.add_argument("--agr", required=False, action="store_true", help="update the agr tool itself")
+        sync_p.add_argument("--remote-jobs", required=False, type=int, default=defs.REMOTE_JOBS, metavar="N",
+                            help="Number of remote repositories to sync concurrently")
+        sync_p.add_argument("--submodule-jobs", required=False, type=int, default=defs.SUBMODULE_JOBS, metavar="N",
+                            help="Number of submodules to check and sync concurrently per remote")
+        sync_p.add_argument("--source-jobs", required=False, type=int, default=defs.SOURCE_JOBS, metavar="N",
+                            help="Number of dynamic packages to download the sources of concurrently")
+        sync_p.add_argument("--host-jobs", required=False, type=int, default=defs.SOURCE_HOST_JOBS, metavar="N",
+                            help="Number of concurrent source downloads from the same host (0 for no limit)")
+        sync_p.add_argument("--full-fetch", required=False, action="store_true",
+                            help="Download the sources of VCS packages even if git ls-remote shows no upstream change")
+        sync_p.add_argument("--verify-srcinfo", required=False, action="store_true",
+                            help=f"Also interpret statically evaluated {defs.PKGBUILD}s with makepkg and report mismatches")
 
         cont_p = cmd.add_parser(defs.CMD_CONT, help="list, set, get, create containers")
         cmd_cont = cont_p.add_subparsers(dest="cmd_cont", required=True)
@@ -134,32 +188,42 @@ class Native:
                 kwargs[f] = getattr(args, f)
         return kwargs
 
-    def cmd_rem(self, report, cmd_rem, name=None, uri=None, branch=None):
+    def cmd_rem(self, report, cmd_rem, name=None, uri=None, branch=None, strategy=defs.STRATEGY_FULL, pkg=None):
         if cmd_rem == defs.CMD_REM_SET:
-            config.CFG.setremote(name, uri, branch)
+            config.CFG.setremote(name, uri, branch, strategy)
         elif cmd_rem == defs.CMD_REM_DEL:
             config.CFG.delremote(name)
+        elif cmd_rem == defs.CMD_REM_SOURCES:
+            config.CFG.setsrcstrategy(name, strategy, pkg)
         elif cmd_rem == defs.CMD_REM_LIST:
             for rname in config.CFG.iterremotes():
                 # TODO: Print description
-                report.log(f"{rname}: {config.CFG.getremote(rname)}")
+                report.log(f"{rname}: {config.CFG.getremote(rname)}, strategy: {config.CFG.getstrategy(rname)}")
+                for pkgname, srcstrategy in config.CFG.iterremotesrcstrategies(rname):
+                    report.log(f"    sources of {pkgname or 'all packages'}: {srcstrategy}")
 
     def cmd_build(self, report, pkgname=None, repo=None, no_repo=None, agrfirst=False,
                   skipinteg=False, skippgpcheck=False, skipchecksum=False,
-                  noconfirm=False, ignorearch=False, force=False):
+                  noconfirm=False, ignorearch=False, force=False, jobs=defs.BUILD_JOBS, cores=defs.BUILD_CORES,
+                  prefetch=defs.PREFETCH_JOBS, tmpfs=defs.TMPFS_BUDGET):
         self.update(noconfirm)
         _, packages, no_packages = agrrepo.filterpkgs(self, pkgname, repo, defs.FILTER_NONE, no_repo, agrfirst, noconfirm)
-        return agrrepo.buildpkgs(self, packages, no_packages, repo, no_repo, agrfirst, skippgpcheck, skipchecksum, skipinteg, noconfirm, ignorearch=ignorearch, force=force)
+        return agrrepo.buildpkgs(self, packages, no_packages, repo, no_repo, agrfirst, skippgpcheck, skipchecksum, skipinteg, noconfirm,
+                                 ignorearch=ignorearch, force=force, jobs=jobs, cores=cores, prefetch=prefetch,
+                                 tmpfsbudget=tmpfs)
 
     def cmd_install(self, report, pkgname=None, repo=None, no_repo=None, agrfirst=False,
                     skipinteg=False, skippgpcheck=False, skipchecksum=False,
-                    noconfirm=False, ignorearch=False):
-        packages = self.cmd_build(report, pkgname, repo, no_repo, agrfirst, skipinteg, skippgpcheck, skipchecksum, noconfirm, ignorearch)
+                    noconfirm=False, ignorearch=False, jobs=defs.BUILD_JOBS, cores=defs.BUILD_CORES,
+                    prefetch=defs.PREFETCH_JOBS, tmpfs=defs.TMPFS_BUDGET):
+        packages = self.cmd_build(report, pkgname, repo, no_repo, agrfirst, skipinteg, skippgpcheck, skipchecksum, noconfirm, ignorearch,
+                                  jobs=jobs, cores=cores, prefetch=prefetch, tmpfs=tmpfs)
         return agrrepo.installpkgs(self, packages, skippgpcheck, skipchecksum, skipinteg, noconfirm, False, ignorearch)
 
     def cmd_update(self, report, pkg=None, repo=None, no_pkg=None, no_repo=None, agrfirst=False,
                    skipinteg=False, skipchecksum=False, skippgpcheck=False,
-                   noconfirm=False, ignorearch=False, agr=False, force=False):
+                   noconfirm=False, ignorearch=False, agr=False, force=False, jobs=defs.BUILD_JOBS,
+                   cores=defs.BUILD_CORES, prefetch=defs.PREFETCH_JOBS, tmpfs=defs.TMPFS_BUDGET):
         if agr:
             retval = agrcmd.run_interactive("python", "-m", "pip", "install", "https://github.com/hbiyik/agr/archive/master.zip",
                                             "--break-system-packages", "--force-reinstall")
@@ -177,7 +241,8 @@ class Native:
                         report.log(f"Update: {package.pkgname} {needsupdate}->{package.version}", True)
                         updates.append(package)
 
-        packages = agrrepo.buildpkgs(self, updates, no_packages, repo, no_repo, agrfirst, skippgpcheck, skipchecksum, skipinteg, noconfirm, force, ignorearch)
+        packages = agrrepo.buildpkgs(self, updates, no_packages, repo, no_repo, agrfirst, skippgpcheck, skipchecksum, skipinteg, noconfirm, force, ignorearch,
+                                     jobs, cores, prefetch, tmpfs)
         if self.name == defs.CONTAINER_NATIVE:
             return agrrepo.installpkgs(self, packages, skippgpcheck, skipchecksum, skipinteg, noconfirm, False, ignorearch)
         else:
@@ -185,19 +250,25 @@ class Native:
 
     def cmd_sync(self, report, pkg=None, repo=None, no_pkg=None, no_repo=None, agrfirst=False,
                  skipinteg=False, skipchecksum=False, skippgpcheck=False,
-                 noconfirm=False, ignorearch=False):
+                 noconfirm=False, ignorearch=False, verify_srcinfo=False, remote_jobs=defs.REMOTE_JOBS,
+                 submodule_jobs=defs.SUBMODULE_JOBS, source_jobs=defs.SOURCE_JOBS, host_jobs=defs.SOURCE_HOST_JOBS,
+                 full_fetch=False):
         clean.clean()
         self.update(noconfirm)
 
         # sync remote git repos
+        remotes = []
         for remote in config.CFG.iterremotes():
             if (no_repo is None or remote not in no_repo) and (repo is None or remote in repo):
-                git.syncremote(remote)
+                remotes.append(remote)
+        for result in git.syncremotes(remotes, remote_jobs, submodule_jobs):
+            report.log(str(result))
 
         # TO-DO: handle all default dlagents
         # get necessary dlagents to sync dynmic packages
         # this stage indirectly sycs static packages therefore cpu bound
-        agrrepo.tempsync(agrrepo.allpkgbuilds(self))
+        processed = agrrepo.syncpkgbuilds(self, verify_srcinfo)
+        report.log(f"Processed {len(processed)} changed {defs.PKGBUILD}s")
 
         pkgbs, _, _ = agrrepo.filterpkgs(self, pkg, repo, no_pkg, no_repo, agrfirst, noconfirm)
 
@@ -214,16 +285,25 @@ class Native:
             agrrepo.installpkgs(self, dlagents, skippgpcheck, skipchecksum, skipinteg, noconfirm, False, ignorearch, immutable=False)
 
         # this stage only syncs the dynamic packages, therefore IO/Net bound
+        failed = agrrepo.syncsources(self, pkgbs, skipinteg, skippgpcheck, source_jobs, host_jobs, not full_fetch)
         for pkgb in pkgbs:
-            try:
-                pkgb.sync(skipinteg, skippgpcheck)
-                if pkgb.isbroken:
-                    self.report.log(f"Failed to sync {pkgb}")
-                else:
-                    self.report.log(f"Synced {pkgb}")
-            except Exception:
-                log.logger.warning(f"Error syncing {pkgb.refname} check {defs.PKGBUILD}")
+            if pkgb in failed:
                 self.report.log(f"Failed to sync {pkgb}")
+            elif pkgb.upstreamchanged is False:
+                self.report.log(f"Synced {pkgb}, upstream has not changed")
+            elif pkgb.downloaded:
+                deltat, size = pkgb.downloaded
+                self.report.log(f"Synced {pkgb}, downloaded {log.sizeof(size)} in {deltat:.2f}s")
+            else:
+                self.report.log(f"Synced {pkgb}")
+
+        report.log(f"{defs.SRCINFO} cache: {srcinfo.counter['hit']} hits, {srcinfo.counter['miss']} misses")
+        evaluated = srcinfo.counter.total("static", "bash")
+        if evaluated:
+            report.log(f"Evaluated {srcinfo.counter['static']}/{evaluated} {defs.PKGBUILD}s without bash")
+        if verify_srcinfo:
+            report.log(f"Verified {srcinfo.counter['verified']} static {defs.SRCINFO}s, {srcinfo.counter['mismatch']} mismatches")
+
         # in case remote repo folder structure changes
         clean.clean()
 
@@ -297,6 +377,10 @@ class Native:
     def process_args(self, *cmd, **kwargs):
         return cmd, kwargs
 
+    def buildargs(self, pkgb):
+        # extra arguments of the container to run the build of a pkgbuild
+        return {}
+
     def update(self, noconfirm=False):
         pass
 
@@ -310,8 +394,34 @@ class Native:
             log.logger.error(msg)
             raise(RuntimeError(msg))
 
-    def parsepacman(self, pacman, offset=0):
-        installed = {}
+    def readpacman(self, sync=False, db=None, run=None):
+        db = db or alpm.Database()
+        run = run or agrcmd.run_stdout
+        try:
+            return list(db.itersync() if sync else db.iterlocal())
+        except (OSError, alpm.AlpmError) as e:
+            log.logger.debug(f"Can not read pacman db {db.dbpath}, falling back to pacman: {e}")
+        if sync:
+            return list(self.iterpacman(run("pacman", "-Si"), 1))
+        return list(self.iterpacman(run("pacman", "-Qi")))
+
+    def querypacman(self, sync=False):
+        return self.indexpacman(self.readpacman(sync))
+
+    def loadpacman(self, sync=False):
+        return self.readpacman(sync, self.pacmandb, self.run_stdout)
+
+    def cachepacman(self, sync=False):
+        # reuse the parsed index until pacman changes the db
+        cachepath = os.path.join(defs.PACMAN_CACHE_PATH, f"{self.name}-{'sync' if sync else 'local'}.json")
+        try:
+            stamp = self.pacmandb.stamp(sync)
+        except OSError as e:
+            log.logger.debug(f"Can not stamp pacman db of {self.name}: {e}")
+            stamp = None
+        return alpm.Snapshot(cachepath).load(stamp, lambda: self.loadpacman(sync))
+
+    def iterpacman(self, pacman, offset=0):
         index = 0
         provides = ""
         for line in pacman.split("\n"):
@@ -328,19 +438,28 @@ class Native:
             if line == "":
                 index = 0
                 if not provides[0].isupper():
-                    provideslist = [pkgbuild.Package(x) for x in provides.split(" ") if x != ""]
+                    provideslist = [x for x in provides.split(" ") if x != ""]
                 else:
                     provideslist = []
-                pkg = pkgbuild.Package(f"{pkgname}={vers}")
-                if pkg not in provideslist:
-                    provideslist.append(pkg)
-                for provide in provideslist:
-                    if provide not in installed:
-                        installed[provide] = [pkg]
-                    if pkg not in installed[provide]:
-                        installed[provide].append(pkg)
+                yield alpm.DbEntry(pkgname, vers, provideslist)
                 provides = ""
-        return installed.copy()
+
+    def indexpacman(self, entries):
+        installed = {}
+        for entry in entries:
+            provideslist = [pkgbuild.Package(x) for x in entry.provides]
+            pkg = pkgbuild.Package(f"{entry.name}={entry.version}")
+            if pkg not in provideslist:
+                provideslist.append(pkg)
+            for provide in provideslist:
+                if provide not in installed:
+                    installed[provide] = [pkg]
+                if pkg not in installed[provide]:
+                    installed[provide].append(pkg)
+        return installed
+
+    def parsepacman(self, pacman, offset=0):
+        return self.indexpacman(self.iterpacman(pacman, offset))
 
     def run_interactive(self, *cmd, **kwargs):
         return agrcmd.run_interactive(*cmd, **kwargs)
@@ -4,7 +4,6 @@ Created on Jan 30, 2024
 @author: boogie
 '''
 import os
-import multiprocessing
 
 
 BASE_PATH = os.path.join(os.path.expanduser('~'), ".agr")
@@ -15,20 +14,41 @@ CONT_PATH_NAME = "containers"
 REPO_PATH_NAME = "gitrepos"
 CACHE_PATH_NAME = "caches"
 CFG_PATH_NAME = "config.json"
+PACMAN_CACHE_NAME = ".pacman"
+JOBSERVER_NAME = ".jobserver"
+STORE_NAME = ".store"
 SRC_PATH = os.path.join(BASE_PATH, SRC_PATH_NAME)
 DIST_PATH = os.path.join(BASE_PATH, DIST_PATH_NAME)
 BUILD_PATH = os.path.join(BASE_PATH, BUILD_PATH_NAME)
 CONT_PATH = os.path.join(BASE_PATH, CONT_PATH_NAME)
 REPO_PATH = os.path.join(BASE_PATH, REPO_PATH_NAME)
 CACHE_PATH = os.path.join(BASE_PATH, CACHE_PATH_NAME)
+PACMAN_CACHE_PATH = os.path.join(CACHE_PATH, PACMAN_CACHE_NAME)
+# root owned, the lock is taken as root and must not be a path the user can replace
+PACMAN_LOCK = "/var/lib/pacman"
+JOBSERVER_PATH = os.path.join(CACHE_PATH, JOBSERVER_NAME)
+STORE_PATH = os.path.join(SRC_PATH, STORE_NAME)
+STORE_GIT_PATH = os.path.join(STORE_PATH, "git")
+STORE_FILES_PATH = os.path.join(STORE_PATH, "files")
 
 CFG_PATH = os.path.join(BASE_PATH, CFG_PATH_NAME)
 VERSION = "1.2.4"
 SRCINFO = ".SRCINFO"
 PKGBUILD = "PKGBUILD"
 PKGHASH = ".PKGHASH"
+VCSHASH = ".VCSHASH"
+FOOTPRINT = ".FOOTPRINT"
+STOREREFS = ".STOREREFS"
+CATALOG = ".catalog.db"
 
 DEF_BRANCH = None
+STRATEGY_FULL = "full"
+STRATEGY_SHALLOW = "shallow"
+STRATEGY_BLOBLESS = "blobless"
+STRATEGY_SPARSE = "sparse"
+STRATEGIES = [STRATEGY_FULL, STRATEGY_SHALLOW, STRATEGY_BLOBLESS, STRATEGY_SPARSE]
+# shallow mirrors break pkgver() functions using git describe or rev-list --count
+SRC_STRATEGIES = [STRATEGY_FULL, STRATEGY_BLOBLESS]
 IGNORE_FLAG = ".agrignore"
 
 COMP_GE = ">="
@@ -42,7 +62,6 @@ VERSION_SEPS = [":", "-", "+", "_", "@"]
 UNCACHED = -1
 
 PATHNAMES = [SRC_PATH_NAME, DIST_PATH_NAME, CONT_PATH_NAME, BUILD_PATH_NAME, REPO_PATH_NAME, CACHE_PATH_NAME, CFG_PATH_NAME]
-DIRS = [SRC_PATH, DIST_PATH, BUILD_PATH, CONT_PATH, REPO_PATH, CACHE_PATH]
 SKIPENV = ["LD_PRELOAD"]
 ENV = os.environ.copy()
 for k in SKIPENV:
@@ -58,11 +77,21 @@ FILTER_ALL = 1
 FILTER_NONE = 2
 
 
-NUMCORES = multiprocessing.cpu_count()
-
-for d in DIRS:
-    if not os.path.exists(d):
-        os.makedirs(d, exist_ok=True)
+NUMCORES = os.cpu_count() or 1
+REMOTE_JOBS = 4
+SUBMODULE_JOBS = 8
+SUBMODULE_RETRIES = 3
+SUBMODULE_BACKOFF = 0.5
+BUILD_JOBS = 1
+BUILD_CORES = NUMCORES
+PREFETCH_JOBS = 2
+SOURCE_JOBS = 4
+SOURCE_HOST_JOBS = 2
+# disk budget of the cached dependency layers of a container
+LAYERS_BUDGET = 20 * 1024 ** 3
+# RAM budget in MiB of the build files on tmpfs, 0 to build on the disk only
+TMPFS_BUDGET = 0
+TMPFS_PATH = os.path.join("/tmp", f"agr-{os.getuid()}")
 
 ARCH_i686 = "i686"
 ARCH_X86_64 = "x86_64"
@@ -80,6 +109,7 @@ CMD_UPDATE = "update"
 CMD_REM_SET = "set"
 CMD_REM_DEL = "del"
 CMD_REM_LIST = "list"
+CMD_REM_SOURCES = "sources"
 CMD_CONT_SET = "set"
 CMD_CONT_GET = "get"
 CMD_CONT_LIST = "list"
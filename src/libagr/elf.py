@@ -14,21 +14,16 @@
  You should have received a copy of the GNU General Public License
  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-import tarfile
 import stat
 import struct
 import re
 import os
 
+from libagr import cache
 from libagr import cmd
 from libagr import log
 from libagr import defs
 
-try:
-    import pyzstd
-except ImportError:
-    pyzstd = None
-
 
 MACHMAP = {
     0x3: defs.ARCH_i686,
@@ -278,13 +273,16 @@ def searchdirs(close=True):
 
 
 def finddeplibs(pkgpath):
+    import tarfile
     provides = []
     libs = []
     execs = []
     deps = []
     f = None
     if pkgpath.endswith(".zst"):
-        if pyzstd is None:
+        try:
+            import pyzstd
+        except ImportError:
             raise RuntimeError("pyzstd is required to analyze .pkg.tar.zst types. Please install python-pyzstd.")
         f = pyzstd.ZstdFile(pkgpath, mode='r')
         t = tarfile.open(fileobj=f)
@@ -348,5 +346,18 @@ def findsystemlibs():
                 libs.append(lib)
 
 
-PROC = ElfFile("/proc/self/exe")
-PROC.close()
+@cache.Cache.runonce
+def proc():
+    elffile = ElfFile("/proc/self/exe")
+    elffile.close()
+    return elffile
+
+
+class ProcArch:
+    # class attribute that reads the arch of the running interpreter only when it is first accessed
+    def __init__(self, fmt=None):
+        self.fmt = fmt
+
+    def __get__(self, obj, objtype=None):
+        arch = proc().arch
+        return self.fmt(arch) if self.fmt else arch
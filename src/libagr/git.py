@@ -3,8 +3,10 @@ Created on Jan 30, 2024
 
 @author: boogie
 '''
+import contextlib
 import os
 import time
+import traceback
 from multiprocessing import pool
 
 from libagr import defs
@@ -32,58 +34,311 @@ def originurl(repopath):
         return None
 
 
-def syncsub(subfolder, rpath):
+def cloneargs(strategy):
+    # sparse remotes check out whole submodules, since those are package dirs themselves
+    if strategy == defs.STRATEGY_SHALLOW:
+        return ["--depth", "1"]
+    elif strategy in [defs.STRATEGY_BLOBLESS, defs.STRATEGY_SPARSE]:
+        return ["--filter=blob:none"]
+    return []
+
+
+def fetchargs(strategy):
+    # partial clones remember their filter
+    if strategy == defs.STRATEGY_SHALLOW:
+        return ["--depth", "1"]
+    return []
+
+
+def repostrategy(rpath):
+    try:
+        return cmd.run_stdout("git", "config", "--get", "agr.strategy", cwd=rpath, env=defs.ENV_GIT)
+    except OSError:
+        # cloned before the strategies were introduced
+        return defs.STRATEGY_FULL
+
+
+def sparsedirs(rpath, rev):
+    # dirs having a PKGBUILD and the submodules
+    dirs = []
+    for entry in cmd.run_stdout("git", "ls-tree", "-r", "-z", rev, cwd=rpath, env=defs.ENV_GIT).split("\x00"):
+        meta, _, path = entry.partition("\t")
+        segments = meta.split(" ")
+        if len(segments) != 3:
+            continue
+        if segments[1] == "commit":
+            dirs.append(path)
+        elif segments[1] == "blob" and os.path.basename(path) == defs.PKGBUILD and os.path.dirname(path):
+            dirs.append(os.path.dirname(path))
+    return sorted(set(dirs))
+
+
+def setsparse(rpath, rev):
+    cmd.run_stdout("git", "sparse-checkout", "set", *sparsedirs(rpath, rev), cwd=rpath, env=defs.ENV_GIT)
+
+
+def syncsub(subfolder, rpath, strategy=defs.STRATEGY_FULL):
     spath = os.path.join(rpath, subfolder)
-    maxretry = 3
+    maxretry = defs.SUBMODULE_RETRIES
     for retry in range(maxretry):
         try:
             cmd.run_interactive("git", "submodule", "update", "--init", "--recursive", "--remote", "--force",
-                                subfolder, cwd=rpath, env=defs.ENV_GIT)
+                                *cloneargs(strategy), subfolder, cwd=rpath, env=defs.ENV_GIT)
             cmd.run_interactive("git", "clean", "-d", "-x", "-f", "-f", cwd=spath, env=defs.ENV_GIT)
             return
         except OSError as e:
-            if retry == maxretry:
+            if retry == maxretry - 1:
                 raise(e)
-            log.logger.info(f"Retrying {retry + 1} to sync {rpath}: {subfolder}")
-            time.sleep(0.1)
+            backoff = defs.SUBMODULE_BACKOFF * 2 ** retry
+            log.logger.info(f"Retrying {retry + 1} to sync {rpath}: {subfolder} in {backoff:.1f}s")
+            time.sleep(backoff)
+
+
+def submoduleconfig(rpath, *args):
+    # {name: {var: value}} of the submodule sections
+    sections = {}
+    for line in cmd.run_stdout("git", "config", *args, "--list", cwd=rpath, env=defs.ENV_GIT).split("\n"):
+        key, _, value = line.partition("=")
+        if not key.startswith("submodule."):
+            continue
+        name, _, var = key[len("submodule."):].rpartition(".")
+        sections.setdefault(name, {})[var] = value
+    return sections
 
 
-def syncsubs(rpath):
-    submodules = cmd.run_stdout("git", "submodule", cwd=rpath, env=defs.ENV_GIT)
-    if submodules == "":
-        return
-    args = []
-    for submodule in submodules.split("\n"):
-        info = submodule.split(" ")
-        if info[0].strip() == "":
-            info.pop(0)
-        subfolder = info[1]
-        args.append([subfolder, rpath])
-    with pool.ThreadPool(8) as p:
-        p.starmap(syncsub, args)
+def remotetips(url, refs):
+    # one ls-remote for all the refs tracked from the same url
+    tips = {}
+    try:
+        output = cmd.run_stdout("git", "ls-remote", url, *refs, env=defs.ENV_GIT)
+    except OSError:
+        return tips
+    for line in output.split("\n"):
+        segments = line.split("\t")
+        if len(segments) == 2:
+            tips[segments[1]] = segments[0]
+    return tips
+
+
+def movedsubs(rpath, jobs=defs.SUBMODULE_JOBS):
+    # submodules whose checked out commit differs from the tip of the branch they track
+    if not os.path.exists(os.path.join(rpath, ".gitmodules")):
+        return [], []
+    modules = submoduleconfig(rpath, "-f", ".gitmodules")
+    urls = submoduleconfig(rpath, "--local")
+    subs = []
+    urlrefs = {}
+    for name, module in modules.items():
+        if "path" not in module:
+            continue
+        url = urls.get(name, {}).get("url")
+        branch = module.get("branch")
+        # "." tracks the branch of the superproject, let git resolve it
+        ref = None if branch == "." else "HEAD" if branch is None else f"refs/heads/{branch}"
+        spath = os.path.join(rpath, module["path"])
+        # uninitialized submodules have no url in the repo config yet
+        head = readhead(spath) if url and os.path.exists(os.path.join(spath, ".git")) else None
+        subs.append((module["path"], url, ref, head))
+        if head and ref:
+            urlrefs.setdefault(url, set()).add(ref)
+
+    tips = {}
+    if urlrefs:
+        with pool.ThreadPool(max(1, min(jobs, len(urlrefs)))) as p:
+            for url, urltips in zip(urlrefs, p.starmap(remotetips, [(url, sorted(refs)) for url, refs in urlrefs.items()])):
+                tips[url] = urltips
+
+    moved = []
+    skipped = []
+    for subfolder, url, ref, head in subs:
+        if head and ref and tips.get(url, {}).get(ref) == head:
+            skipped.append(subfolder)
+        else:
+            moved.append(subfolder)
+    return moved, skipped
+
+
+def syncsubs(rpath, strategy=defs.STRATEGY_FULL, jobs=defs.SUBMODULE_JOBS):
+    moved, skipped = movedsubs(rpath, jobs)
+    if skipped:
+        log.logger.info(f"Skipping {len(skipped)} unchanged submodules in {rpath}")
+    if moved:
+        with pool.ThreadPool(max(1, min(jobs, len(moved)))) as p:
+            p.starmap(syncsub, [[subfolder, rpath, strategy] for subfolder in moved])
+    return moved, skipped
+
+
+class RemoteSync:
+    def __init__(self, rname):
+        self.rname = rname
+        self.changed = False
+        self.error = None
+        self.timings = {}
+        self.subsynced = 0
+        self.subskipped = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        t1 = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.time() - t1
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"Failed to sync remote {self.rname}: {self.error}"
+        phases = ", ".join([f"{k} {v:.2f}s" for k, v in self.timings.items()])
+        return f"Synced remote {self.rname} in {sum(self.timings.values()):.2f}s ({phases}), " + \
+               f"submodules: {self.subsynced} synced, {self.subskipped} skipped"
 
 
+# subjobs is keyword only, runonce keys on the positional args, so a remote syncs once whoever asks for it
 @cache.Cache.runonce
-def syncremote(rname):
+def syncremote(rname, *, subjobs=defs.SUBMODULE_JOBS):
     log.logger.info(f"Looking up remote: {rname}: {config.CFG.getremote(rname)}")
 
+    result = RemoteSync(rname)
     remote, branch = config.CFG.getremote(rname)
+    strategy = config.CFG.getstrategy(rname)
     rpath = repopath(rname)
     if os.path.exists(rpath):
         oldremote = originurl(rpath)
-        if (oldremote == remote):
-            cmd.run_stdout("git", "fetch", "origin", branch, cwd=rpath, env=defs.ENV_GIT)
-            cmd.run_stdout("git", "clean", "-d", "-x", "-f", "-f", cwd=rpath, env=defs.ENV_GIT)
-            cmd.run_stdout("git", "reset", "--hard", f"origin/{branch}", cwd=rpath, env=defs.ENV_GIT)
-            syncsubs(rpath)
-            return
+        if (oldremote == remote) and repostrategy(rpath) == strategy:
+            with result.phase("fetch"):
+                cmd.run_stdout("git", "fetch", *fetchargs(strategy), "origin", branch, cwd=rpath, env=defs.ENV_GIT)
+                head = readhead(rpath)
+                fetched = cmd.run_stdout("git", "rev-parse", f"origin/{branch}", cwd=rpath, env=defs.ENV_GIT)
+            if head == fetched:
+                log.logger.info(f"Remote {rname} is already at {fetched}")
+            else:
+                with result.phase("reset"):
+                    if strategy == defs.STRATEGY_SPARSE:
+                        setsparse(rpath, f"origin/{branch}")
+                    cmd.run_stdout("git", "clean", "-d", "-x", "-f", "-f", cwd=rpath, env=defs.ENV_GIT)
+                    cmd.run_stdout("git", "reset", "--hard", f"origin/{branch}", cwd=rpath, env=defs.ENV_GIT)
+            # submodules follow their own remote branches, they can move without a new commit
+            with result.phase("submodules"):
+                moved, skipped = syncsubs(rpath, strategy, subjobs)
+            result.subsynced, result.subskipped = len(moved), len(skipped)
+            result.changed = head != fetched
+            return result
         cmd.run_stdout("rm", "-rf", rpath)
     os.makedirs(rpath, exist_ok=True)
-    cmd.run_stdout("git", "clone", "-b", branch, remote, ".", cwd=rpath, env=defs.ENV_GIT)
-    syncsubs(rpath)
+    with result.phase("clone"):
+        log.logger.info(f"Cloning {remote} with {strategy} strategy")
+        if strategy == defs.STRATEGY_SPARSE:
+            cmd.run_stdout("git", "clone", *cloneargs(strategy), "--no-checkout", "-b", branch, remote, ".", cwd=rpath, env=defs.ENV_GIT)
+            cmd.run_stdout("git", "sparse-checkout", "init", "--cone", cwd=rpath, env=defs.ENV_GIT)
+            setsparse(rpath, "HEAD")
+            cmd.run_stdout("git", "checkout", branch, cwd=rpath, env=defs.ENV_GIT)
+        else:
+            cmd.run_stdout("git", "clone", *cloneargs(strategy), "-b", branch, remote, ".", cwd=rpath, env=defs.ENV_GIT)
+        cmd.run_stdout("git", "config", "agr.strategy", strategy, cwd=rpath, env=defs.ENV_GIT)
+    with result.phase("submodules"):
+        moved, skipped = syncsubs(rpath, strategy, subjobs)
+    result.subsynced, result.subskipped = len(moved), len(skipped)
+    result.changed = True
+    return result
+
+
+def syncremotes(rnames, jobs=defs.REMOTE_JOBS, subjobs=defs.SUBMODULE_JOBS):
+    # remotes are synced concurrently, a failing remote does not stop the others
+    def _syncremote(rname):
+        try:
+            return syncremote(rname, subjobs=subjobs)
+        except Exception as e:
+            log.logger.warning(f"Error syncing remote {rname}: {e}")
+            log.logger.debug(traceback.format_exc())
+            result = RemoteSync(rname)
+            result.error = e
+            return result
+
+    if not rnames:
+        return []
+    with pool.ThreadPool(max(1, min(jobs, len(rnames)))) as p:
+        return p.map(_syncremote, rnames)
 
 
 def getcommit(path):
     if path == ".":
         path = ""
     return cmd.run_stdout("git", "rev-parse", "HEAD", cwd=path)
+
+
+def gitdir(path):
+    # submodules keep a "gitdir: ..." file instead of the .git folder
+    dotgit = os.path.join(path, ".git")
+    if os.path.isfile(dotgit):
+        with open(dotgit, "r") as f:
+            content = f.read().strip()
+        if content.startswith("gitdir:"):
+            return os.path.normpath(os.path.join(path, content[len("gitdir:"):].strip()))
+    return dotgit
+
+
+def readhead(path):
+    # resolve HEAD from the files in gitdir, this is called per package so it should not fork git
+    try:
+        gdir = gitdir(path)
+        with open(os.path.join(gdir, "HEAD"), "r") as f:
+            head = f.read().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head[len("ref:"):].strip()
+        refpath = os.path.join(gdir, ref)
+        if os.path.exists(refpath):
+            with open(refpath, "r") as f:
+                return f.read().strip()
+        with open(os.path.join(gdir, "packed-refs"), "r") as f:
+            for line in f.read().split("\n"):
+                segments = line.split(" ")
+                if len(segments) == 2 and segments[1] == ref:
+                    return segments[0]
+    except OSError:
+        pass
+    try:
+        return getcommit(path)
+    except OSError:
+        return None
+
+
+def treeids(rpath):
+    # ids of every tree and gitlink in HEAD
+    ids = {".": ("tree", cmd.run_stdout("git", "rev-parse", "HEAD^{tree}", cwd=rpath, env=defs.ENV_GIT))}
+    for entry in cmd.run_stdout("git", "ls-tree", "-r", "-t", "-z", "HEAD", cwd=rpath, env=defs.ENV_GIT).split("\x00"):
+        meta, _, path = entry.partition("\t")
+        segments = meta.split(" ")
+        if len(segments) == 3 and segments[1] in ["tree", "commit"]:
+            ids[path] = (segments[1], segments[2])
+    return ids
+
+
+def lsremote(url, ref):
+    # refs matching ref on the remote, without fetching anything
+    return cmd.run_stdout("git", "ls-remote", url, ref, env=defs.ENV_GIT)
+
+
+def ispartial(rpath):
+    try:
+        return cmd.run_stdout("git", "config", "--get", "remote.origin.promisor", cwd=rpath, env=defs.ENV_GIT) == "true"
+    except OSError:
+        return False
+
+
+def hydrate(rpath, rev):
+    # fetch the missing blobs of a revision in a partial clone, a checkout fetches them in one batch
+    wtpath = f"{rpath}.hydrate"
+    cmd.run_stdout("rm", "-rf", wtpath)
+    cmd.run_stdout("git", "worktree", "prune", cwd=rpath, env=defs.ENV_GIT)
+    try:
+        cmd.run_stdout("git", "worktree", "add", "--detach", "--force", wtpath, rev, cwd=rpath, env=defs.ENV_GIT)
+    finally:
+        cmd.run_stdout("rm", "-rf", wtpath)
+        cmd.run_stdout("git", "worktree", "prune", cwd=rpath, env=defs.ENV_GIT)
+
+
+def changedpaths(rpath, old, new):
+    # paths changed in between two commits, a moved submodule is listed with its gitlink path
+    diff = cmd.run_stdout("git", "diff", "--name-only", "--no-renames", "-z", old, new, cwd=rpath, env=defs.ENV_GIT)
+    return [x for x in diff.split("\x00") if x]
@@ -0,0 +1,134 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import os
+import shutil
+import stat
+import threading
+
+from libagr import defs
+from libagr import log
+
+
+# makepkg reads MAKEFLAGS from its config, not from the environment, so the config is wrapped. the pacman
+# transactions of concurrent builds queue on the lock of agr instead of failing on the db lock of pacman
+SHELL_MAKEPKGCONF = """source /etc/makepkg.conf
+for __agr_conf in /etc/makepkg.conf.d/*.conf; do
+    [[ -f $__agr_conf ]] && source "$__agr_conf"
+done
+unset __agr_conf
+MAKEFLAGS="{makeflags}"
+PACMAN_AUTH=(sudo flock "{pacmanlock}")
+export PATH="{bindir}:$PATH"
+"""
+
+# ninja has no jobserver client, it is capped to the share of a build unless the build asks for a job count itself
+SHELL_NINJA = """#!/bin/bash
+__agr_bin="{bindir}:"
+PATH="${{PATH//$__agr_bin/}}"
+for __agr_arg in "$@"; do
+    [[ $__agr_arg == -j* ]] && exec ninja "$@"
+done
+exec ninja -j{share} "$@"
+"""
+
+lock = threading.Lock()
+current = None
+
+
+class Jobserver:
+    # GNU make jobserver shared by all the builds agr runs, each top level make holds one implicit token
+    # so the fifo is filled with the remaining tokens of the budget
+    def __init__(self, cores=defs.BUILD_CORES, jobs=defs.BUILD_JOBS):
+        self.cores = max(1, cores)
+        self.jobs = max(1, min(jobs, self.cores))
+        self.fifo_path = os.path.join(defs.JOBSERVER_PATH, f"{os.getpid()}.fifo")
+        self.makepkgconf_path = os.path.join(defs.JOBSERVER_PATH, f"{os.getpid()}.conf")
+        self.bin_path = os.path.join(defs.JOBSERVER_PATH, f"{os.getpid()}.bin")
+        self.fd = None
+
+    @property
+    def makeflags(self):
+        return f"-j{self.cores} --jobserver-auth=fifo:{self.fifo_path}"
+
+    @property
+    def share(self):
+        # tools without jobserver support get an equal share of the budget
+        return max(1, self.cores // self.jobs)
+
+    @property
+    def env(self):
+        share = str(self.share)
+        return {"MAKEFLAGS": self.makeflags,
+                "MAKEPKG_CONF": self.makepkgconf_path,
+                "CARGO_BUILD_JOBS": share,
+                "CMAKE_BUILD_PARALLEL_LEVEL": share,
+                "SAMUFLAGS": f"-j{share}",
+                # meson compile runs the ninja in NINJA, cmake runs the one it found at configure time with -j of
+                # CMAKE_BUILD_PARALLEL_LEVEL, the rest find the shim in PATH
+                "NINJA": os.path.join(self.bin_path, "ninja")}
+
+    def start(self):
+        os.makedirs(defs.JOBSERVER_PATH, exist_ok=True)
+        # leftovers of the agr processes that did not exit cleanly
+        for fname in os.listdir(defs.JOBSERVER_PATH):
+            pid = fname.split(".")[0]
+            if pid.isdigit() and not os.path.exists(f"/proc/{pid}"):
+                path = os.path.join(defs.JOBSERVER_PATH, fname)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        self.remove()
+        os.mkfifo(self.fifo_path, 0o600)
+        # keep both ends open so the fifo never sees eof and the tokens live as long as agr
+        self.fd = os.open(self.fifo_path, os.O_RDWR)
+        os.write(self.fd, b"+" * (self.cores - self.jobs))
+        with open(self.makepkgconf_path, "w") as f:
+            f.write(SHELL_MAKEPKGCONF.format(makeflags=self.makeflags, bindir=self.bin_path,
+                                             pacmanlock=defs.PACMAN_LOCK))
+        os.makedirs(self.bin_path)
+        ninja_path = os.path.join(self.bin_path, "ninja")
+        with open(ninja_path, "w") as f:
+            f.write(SHELL_NINJA.format(bindir=self.bin_path, share=self.share))
+        os.chmod(ninja_path, stat.S_IRWXU)
+        log.logger.debug(f"Started jobserver {self.fifo_path} with {self.cores} cores for {self.jobs} jobs")
+
+    def remove(self):
+        for path in [self.fifo_path, self.makepkgconf_path]:
+            if os.path.exists(path):
+                os.remove(path)
+        if os.path.exists(self.bin_path):
+            shutil.rmtree(self.bin_path)
+
+    def stop(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.remove()
+
+    def __enter__(self):
+        global current
+        with lock:
+            if current is not None:
+                raise RuntimeError(f"Jobserver {current.fifo_path} is already running")
+            self.start()
+            current = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global current
+        with lock:
+            self.stop()
+            current = None
+        return False
+
+
+def env():
+    # environment for a build, empty if the builds are not run under a jobserver
+    with lock:
+        if current is None:
+            return {}
+        return current.env
@@ -7,6 +7,7 @@ import logging
 import copy
 import time
 import sys
+import threading
 
 MAPPING = {'DEBUG': 37,  # white
            'INFO': 36,  # cyan
@@ -57,6 +58,30 @@ def setlevel(level):
     ch.setLevel(level)
 
 
+class Counter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def inc(self, key, count=1):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def __getitem__(self, key):
+        return self.counts.get(key, 0)
+
+    def total(self, *keys):
+        return sum([self[x] for x in keys])
+
+
+def sizeof(num):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if abs(num) < 1024 or unit == "GiB":
+            break
+        num /= 1024
+    return f"{num:.0f}{unit}" if unit == "B" else f"{num:.1f}{unit}"
+
+
 class Report:
     def __init__(self):
         self.buffer = []
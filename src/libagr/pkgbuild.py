@@ -7,23 +7,70 @@ import os
 import re
 import time
 import hashlib
+import json
+import urllib.parse
 
 from libagr import cache
+from libagr import catalog
+from libagr import config
 from libagr import defs
 from libagr import git
+from libagr import jobserver
 from libagr import log
 from libagr import version
 from libagr import cmd
+from libagr import shell
+from libagr import srcinfo
+from libagr import store
+from libagr import tmpfs
 
 
-SHELL_ISDYNAMIC = "echo \"$(type -t pkgver)\""
-with open("/usr/share/makepkg/srcinfo.sh", "r") as f:
-    SHELL_SRCINFO = "\n" + f.read()
-SHELL_SRCINFO += "\nwrite_srcinfo"
+SHELL_SRCINFO_LIB = "/usr/share/makepkg/srcinfo.sh"
 SHELL_MAKEDEPS = 'echo "${makedepends[*]}"'
+# local files a PKGBUILD can source or refer to, these are hashed together with the PKGBUILD
+RE_LOCALFILES = re.compile(r"^\s*(?:(?:source|\.)\s+|(?:install|changelog)=)[\"']?([^\s;&|\"']+)", re.M)
+LOCALFILE_EXTS = [".sh", ".install"]
 
 PKG_FILTERCHARS = {":": "."}
 
+VCS_GIT = ["git"]
+VCS_OTHER = ["bzr", "fossil", "hg", "svn"]
+
+
+
+@cache.Cache.runonce
+def srcinfopool():
+    # makepkg's srcinfo library is parsed once per worker, not once per PKGBUILD
+    with open(SHELL_SRCINFO_LIB, "r") as f:
+        prelude = f.read()
+    return shell.BashPool(defs.NUMCORES, prelude, defs.ENV_GIT)
+
+
+@cache.Cache.runonce
+def srcinfolibhash():
+    try:
+        with open(SHELL_SRCINFO_LIB, "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except OSError:
+        return
+
+
+def pacman(*args):
+    # pacman fails instead of waiting when its db is locked, so concurrent transactions queue on a lock first,
+    # makepkg does the same through PACMAN_AUTH in the makepkg.conf of the jobserver
+    return ["sudo", "flock", defs.PACMAN_LOCK, "pacman", *args]
+
+
+def dirsize(path):
+    size = 0
+    for root, _dirs, files in os.walk(path):
+        for fname in files:
+            try:
+                size += os.lstat(os.path.join(root, fname)).st_size
+            except OSError:
+                pass
+    return size
+
 
 def foldername(path):
     path = os.path.realpath(path)
@@ -116,14 +163,84 @@ class Package:
         return None
 
 
+class Artifact:
+    def __init__(self, fname, pkgname, pkgver, pkgrel, arch, ext):
+        self.fname = fname
+        self.pkgname = pkgname
+        self.pkgver = pkgver
+        self.pkgrel = pkgrel
+        self.arch = arch
+        self.ext = ext
+        self.version = version.Version(f"{pkgver}-{pkgrel}")
+
+    @staticmethod
+    def parse(fname):
+        pkgname, pkgver, pkgrel = Package.fnameparse(fname)
+        if pkgname is None:
+            return
+        # pgname-[epoch:]pkgver-pkgrel-arch.ext
+        tail = fname.split("-")[-1]
+        arch = tail.split(".")[0]
+        return Artifact(fname, pkgname, pkgver, pkgrel, arch, tail[len(arch):])
+
+    def __repr__(self):
+        return self.fname
+
+
+class ArtifactIndex:
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.artifacts = {}
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime == self.mtime:
+            return
+        log.logger.debug(f"Indexing artifacts in {self.path}")
+        artifacts = {}
+        if mtime is not None:
+            for fname in os.listdir(self.path):
+                artifact = Artifact.parse(fname)
+                if artifact:
+                    artifacts.setdefault(artifact.pkgname, []).append(artifact)
+        # sorted from oldest to latest version
+        for pkgartifacts in artifacts.values():
+            pkgartifacts.sort(key=lambda x: (x.version.segments, x.fname))
+        self.artifacts = artifacts
+        self.mtime = mtime
+
+    def invalidate(self):
+        self.mtime = None
+
+    def get(self, pkgname):
+        self.refresh()
+        return self.artifacts.get(pkgname, [])
+
+
+@cache.Cache.runonce
+def artifactindex(distpath):
+    return ArtifactIndex(distpath)
+
+
 class Pkgbuild:
     def __init__(self, container, rname, pkgpath):
         self.container = container
         self._srcinfo = None
         self._isdynamic = None
+        self._evaluated = None
         self._pkgsrc = None
         self._artifacts = None
         self.isbroken = False
+        # seconds and bytes of the last source download
+        self.downloaded = None
+        # False when the vcs sources did not change upstream and the download was skipped
+        self.upstreamchanged = None
+        # repo packages the build depends on, as resolved for the current build
+        self.sysdeps = []
         self.remotename = rname
         self.pkgpath = pkgpath
         self.pkgfullpath = git.repopkgpath(self.remotename, self.pkgpath)
@@ -133,6 +250,11 @@ class Pkgbuild:
         self.distpath = os.path.join(defs.DIST_PATH, self.container.name, self.remotename)
         self.cachepath = os.path.join(defs.CACHE_PATH, self.remotename)
         self.srcinfo_path = os.path.join(self.cachepath, f"{self.refname}{defs.SRCINFO}")
+        self.pkghash_path = os.path.join(self.cachepath, f"{self.refname}{defs.PKGHASH}")
+        self.vcshash_path = os.path.join(self.cachepath, f"{self.refname}{defs.VCSHASH}")
+        self.footprint_path = os.path.join(self.cachepath, f"{self.refname}{defs.FOOTPRINT}")
+        self.artifactindex = artifactindex(self.distpath)
+        self.catalog = catalog.getcatalog(self.remotename)
         self.epoch = None
         self._pkgrel = 1
         self.pkgver = None
@@ -168,6 +290,7 @@ class Pkgbuild:
             new_pkgsource += f"\npkgrel={value}"
         with open(os.path.join(self.pkgfullpath, "PKGBUILD"), "w") as f:
             f.write(new_pkgsource)
+        self._pkgsrc = new_pkgsource
         log.logger.info("pkgrel is bumped form %s to %s for %s",
                         self._pkgrel,
                         value,
@@ -237,16 +360,12 @@ class Pkgbuild:
                     self.pkgnames.append(provide)
 
         # use the pkgrel of latest built artifacts pkgrel
-        for fname in os.listdir(self.distpath):
-            pkgname, pkgver, pkgrel = Package.fnameparse(fname)
-            if pkgname is None:
-                continue
-            if pkgname not in self.pkgname:
-                continue
-            if not Package.filterchars(self.pkgver) == pkgver:
-                continue
-            if pkgrel > self.pkgrel:
-                self.pkgrel = pkgrel
+        for package in self.pkgname:
+            for artifact in self.artifactindex.get(package.pkgname):
+                if not Package.filterchars(self.pkgver) == artifact.pkgver:
+                    continue
+                if artifact.pkgrel > self.pkgrel:
+                    self.pkgrel = artifact.pkgrel
 
         for attr in [self.pkgname, self.pkgnames]:
             for pkg in attr:
@@ -261,13 +380,28 @@ class Pkgbuild:
             self.pkgbase.version = self.version
             self.pkgbase.pkgbuild = self
 
-    def itersrcinfo(self):
-        if self.srcinfo:
-            for line in self.srcinfo.split("\n"):
+    @staticmethod
+    def parsesrcinfo(srcinfo):
+        records = []
+        if srcinfo:
+            for line in srcinfo.split("\n"):
                 splits = line.split(" = ")
                 if len(splits) == 2:
                     k, v = splits
-                    yield k.strip(), v.strip()
+                    records.append((k.strip(), v.strip()))
+        return records
+
+    def itersrcinfo(self):
+        if self._srcinfo:
+            # generated in this run
+            return self.parsesrcinfo(self._srcinfo)
+        records = self.catalog.get(self.pkgpath)
+        if records is None:
+            records = self.parsesrcinfo(self.srcinfo)
+            # the cache file might be from an older checkout
+            if self._srcinfo and self.cachedpkghash() == self.pkghash():
+                self.catalog.put(self.pkgpath, records)
+        return records
 
     @property
     def artifacts(self):
@@ -286,27 +420,50 @@ class Pkgbuild:
                 self._pkgsrc = f.read()
         return self._pkgsrc
 
+    def evaluate(self, verify=False):
+        # srcinfo and pkgver() check of the current pkgsrc in one go
+        pkgsrc = self.pkgsrc
+        if self._evaluated is None or self._evaluated[0] is not pkgsrc:
+            try:
+                evaluated = srcinfo.evaluate(pkgsrc)
+                srcinfo.counter.inc("static")
+            except srcinfo.NotStatic as e:
+                log.logger.debug(f"Can not evaluate {self} statically: {e}")
+                srcinfo.counter.inc("bash")
+                evaluated = None
+            if evaluated is None or verify:
+                log.logger.debug(f"Interpret srcinfo {self}")
+                interpreted = srcinfopool().evaluate(pkgsrc, os.path.dirname(self.pkgfullpath), self.env)
+                if evaluated is not None:
+                    srcinfo.verify(self, *evaluated, *interpreted, self.parsesrcinfo)
+                evaluated = interpreted
+            self._evaluated = pkgsrc, *evaluated
+        return self._evaluated[1:]
+
     @property
     def isdynamic(self):
         if self._isdynamic is None:
-            log.logger.debug(f"Interpret isdynamic {self}")
-            self._isdynamic = cmd.run_stdout("bash", "-c", self.pkgsrc + "\n" + SHELL_ISDYNAMIC,
-                                                cwd=os.path.dirname(self.pkgfullpath), env=self.env) != ""
+            _srcinfo, self._isdynamic = self.evaluate()
         return self._isdynamic
 
     @isdynamic.setter
     def isdynamic(self, val):
         self._isdynamic = val
 
-    def gensrcinfo(self):
-        log.logger.debug(f"Interpret srcinfo {self}")
-        self._srcinfo = cmd.run_stdout("bash", "-c", self.pkgsrc + "\n" + SHELL_SRCINFO,
-                                          cwd=os.path.dirname(self.pkgfullpath), env=self.env)
+    def gensrcinfo(self, verify=False):
+        self._srcinfo, self._isdynamic = self.evaluate(verify)
         self._srcinfo += f"\nisbroken = {'true' if self.isbroken else ''}"
         self._srcinfo += f"\nisdynamic = {'true' if self.isdynamic else ''}"
 
-    def sync(self, skipinteg=False, skippgpcheck=False, download=True):
+    def sync(self, skipinteg=False, skippgpcheck=False, download=True, fast=False):
         # if dynamic, sync pkg sources, we can never know the correct pkgver otherwise
+        vcsstate = None
+        if self.isdynamic and download and fast:
+            vcsstate = self.vcsstate()
+            if vcsstate is not None and self.cachedvcsstate() == vcsstate:
+                log.logger.info(f"Upstream of {self.refname} has not changed, skipped downloading sources")
+                self.upstreamchanged = False
+                return
         if self.isdynamic:
             t1 = time.time()
             log.logger.info(f"Started downloading sources of {self.refname}")
@@ -317,8 +474,15 @@ class Pkgbuild:
                         cmd.append("--skipinteg")
                     if skippgpcheck:
                         cmd.append("--skippgpcheck")
+                    # sources linked from the store are not downloads
+                    self.linkstore()
+                    size = dirsize(self.srcpath)
+                    self.syncmirrors()
                     self.container.run_interactive(*cmd, cwd=self.pkgfullpath, env=self.env)
+                    self.fillstore()
                     deltat = time.time() - t1
+                    self.downloaded = deltat, max(0, dirsize(self.srcpath) - size)
+                    self.upstreamchanged = True
                     log.logger.info(f"Finished downloading sources of {self.refname} in {deltat:.2f} seconds")
                 # update the pkbuild source
                 with open(os.path.join(self.pkgfullpath, defs.PKGBUILD)) as f:
@@ -328,32 +492,188 @@ class Pkgbuild:
                 log.logger.warning(f"Error in {self} check {defs.PKGBUILD}")
                 self.isbroken = True
 
-        pkghash_path = os.path.join(self.cachepath, f"{self.refname}{defs.PKGHASH}")
-        pkghash = None
-        actual_pkghash = hashlib.md5(self.pkgsrc.encode()).hexdigest()
-
-        # read the cached pkghash
-        if os.path.exists(pkghash_path):
-            with open(pkghash_path, "r") as f:
-                pkghash = f.read()
-                log.logger.debug(f"Read pkg hash {pkghash_path}")
-
-        # if cache is not valid regenerate srcinfo and cache it
-        if not download or os.path.exists(self.srcinfo_path) or pkghash != actual_pkghash:
-            log.logger.info(f"Syncing {self.srcinfo_path}")
-            # generate srcinfo
-            if not self._srcinfo:
-                self.gensrcinfo()
-
-            # cache srcinfo
-            with open(self.srcinfo_path, "w") as f:
-                log.logger.debug(f"Write srcinfo {self.srcinfo_path}")
-                f.write(self._srcinfo)
-
-            # cache pkghash
-            with open(pkghash_path, "w") as f:
-                log.logger.debug(f"Write pkghash {pkghash_path}")
-                f.write(actual_pkghash)
+        self.syncsrcinfo(force=self.isbroken)
+        if vcsstate is not None and not self.isbroken:
+            # pkgver() has updated the PKGBUILD, the state is valid for the updated one
+            with open(self.vcshash_path, "w") as f:
+                log.logger.debug(f"Write vcs hash {self.vcshash_path}")
+                json.dump({"pkghash": self.pkghash(), "sources": vcsstate}, f)
+
+    def itervcssources(self):
+        # vcs, source, dir name in SRCDEST, url, fragment type and value of the vcs sources, parsed like makepkg does
+        for k, v in self.itersrcinfo():
+            if k != "source" and not k.startswith("source_"):
+                continue
+            name, sep, url = v.partition("::")
+            if not sep:
+                url = name
+            scheme, sep, _ = url.partition("://")
+            if not sep:
+                # local file
+                continue
+            vcs = scheme.split("+")[0]
+            if vcs not in VCS_GIT + VCS_OTHER:
+                continue
+            url, _, fragment = url.partition("#")
+            url = url.split("?")[0]
+            if url.startswith(f"{vcs}+"):
+                url = url[len(vcs) + 1:]
+            name = name.split("#")[0].split("?")[0].rstrip("/").split("/")[-1]
+            if vcs in VCS_GIT:
+                name = name.split(".git")[0]
+            fragtype, _, fragval = fragment.partition("=")
+            yield vcs, v, name, url, fragtype, fragval
+
+    def vcsstate(self):
+        # upstream refs of the vcs sources, None if any of them can not be checked without downloading
+        state = {}
+        for vcs, source, _name, url, fragtype, fragval in self.itervcssources():
+            if vcs not in VCS_GIT:
+                return
+            if fragtype == "commit":
+                state[source] = fragval
+                continue
+            ref = {"branch": f"refs/heads/{fragval}", "tag": f"refs/tags/{fragval}"}.get(fragtype, "HEAD")
+            try:
+                state[source] = git.lsremote(url, ref)
+            except OSError:
+                return
+        return state
+
+    def syncmirrors(self):
+        # blobless mirrors of the git sources in SRCDEST, makepkg fetches them itself but clones them with -s,
+        # so the blobs of the revision it checks out must already be in the mirror
+        pkgname = self.pkgbase.pkgname if self.pkgbase else None
+        if config.CFG.getsrcstrategy(self.remotename, pkgname) != defs.STRATEGY_BLOBLESS:
+            return
+        for vcs, _source, name, url, fragtype, fragval in self.itervcssources():
+            if vcs not in VCS_GIT:
+                continue
+            mirror = os.path.join(self.srcpath, name)
+            rev = {"branch": f"refs/heads/{fragval}", "tag": f"refs/tags/{fragval}^{{commit}}", "commit": fragval}.get(fragtype, "HEAD")
+            try:
+                if os.path.exists(mirror) and git.ispartial(mirror):
+                    cmd.run_stdout("git", "fetch", "--all", "-p", cwd=mirror, env=defs.ENV_GIT)
+                else:
+                    log.logger.info(f"Creating blobless mirror of {url} for {self.refname}")
+                    cmd.run_stdout("rm", "-rf", mirror)
+                    cmd.run_stdout("git", "clone", "--mirror", "--filter=blob:none", url, mirror, env=defs.ENV_GIT)
+                git.hydrate(mirror, rev)
+            except OSError:
+                log.logger.warning(f"Can not prepare blobless mirror {mirror}, makepkg will fetch it")
+
+    def iterstoresources(self):
+        # file name in SRCDEST, hash algorithm and checksum of the downloaded file sources that have a checksum
+        sources = {}
+        checksums = {}
+        for k, v in self.itersrcinfo():
+            key, _, arch = k.partition("_")
+            if key == "source":
+                sources.setdefault(arch, []).append(v)
+            elif key in srcinfo.HASH_SUMS:
+                checksums.setdefault((key[:-4], arch), []).append(v)
+        for arch, archsources in sources.items():
+            for i, source in enumerate(archsources):
+                name, sep, url = source.partition("::")
+                if not sep:
+                    url = name
+                scheme, sep, _ = url.partition("://")
+                if not sep or scheme.split("+")[0] in VCS_GIT + VCS_OTHER:
+                    continue
+                for algo in store.HASHES:
+                    archchecksums = checksums.get((algo, arch), [])
+                    if i < len(archchecksums) and archchecksums[i] != "SKIP":
+                        yield name.split("/")[-1], algo, archchecksums[i]
+                        break
+
+    def linkstore(self):
+        # sources that any package has already downloaded are served from the content addressed store,
+        # git sources by their url and files by their checksum
+        pkgname = self.pkgbase.pkgname if self.pkgbase else None
+        if config.CFG.getsrcstrategy(self.remotename, pkgname) == defs.STRATEGY_FULL:
+            for vcs, _source, name, url, _fragtype, _fragval in self.itervcssources():
+                if vcs not in VCS_GIT:
+                    continue
+                mirror = os.path.join(self.srcpath, name)
+                try:
+                    if os.path.exists(mirror) and git.ispartial(mirror):
+                        # the strategy has changed from blobless
+                        cmd.run_stdout("rm", "-rf", mirror)
+                    store.linkgit(url, mirror)
+                except OSError:
+                    log.logger.warning(f"Can not link {mirror} to the store, makepkg will fetch it")
+        for fname, algo, checksum in self.iterstoresources():
+            try:
+                if store.linkfile(os.path.join(self.srcpath, fname), algo, checksum):
+                    log.logger.info(f"Using {fname} of {self.refname} from the store")
+            except OSError as e:
+                log.logger.warning(f"Can not link {fname} of {self.refname} from the store: {e}")
+
+    def fillstore(self):
+        for fname, algo, checksum in self.iterstoresources():
+            try:
+                store.addfile(os.path.join(self.srcpath, fname), algo, checksum)
+            except OSError as e:
+                log.logger.warning(f"Can not store {fname} of {self.refname}: {e}")
+
+    def cachedvcsstate(self):
+        # vcs state of the last download, if the srcinfo generated from that download is still valid
+        if not os.path.exists(self.vcshash_path) or not os.path.exists(self.srcinfo_path):
+            return
+        try:
+            with open(self.vcshash_path, "r") as f:
+                log.logger.debug(f"Read vcs hash {self.vcshash_path}")
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        pkghash = self.pkghash()
+        if cached.get("pkghash") == pkghash and self.cachedpkghash() == pkghash:
+            return cached.get("sources")
+
+    def pkghash(self):
+        # hash of everything the srcinfo is generated from
+        pkghash = hashlib.md5()
+        for part in [self.container.name, srcinfolibhash(), self.pkgsrc]:
+            pkghash.update(f"{part}\0".encode())
+        localfiles = [os.path.basename(x) for x in RE_LOCALFILES.findall(self.pkgsrc)]
+        for fname in sorted(os.listdir(self.pkgfullpath)):
+            fpath = os.path.join(self.pkgfullpath, fname)
+            if fname == defs.PKGBUILD or not os.path.isfile(fpath):
+                continue
+            if fname in localfiles or os.path.splitext(fname)[1] in LOCALFILE_EXTS:
+                with open(fpath, "rb") as f:
+                    pkghash.update(f"{fname}\0".encode() + f.read())
+        return pkghash.hexdigest()
+
+    def cachedpkghash(self):
+        if os.path.exists(self.pkghash_path):
+            with open(self.pkghash_path, "r") as f:
+                log.logger.debug(f"Read pkg hash {self.pkghash_path}")
+                return f.read()
+
+    def syncsrcinfo(self, verify=False, force=False):
+        # regenerates and caches the srcinfo only if any of its inputs has changed, returns True if so
+        pkghash = self.pkghash()
+        if not verify and not force and os.path.exists(self.srcinfo_path) and self.cachedpkghash() == pkghash:
+            srcinfo.counter.inc("hit")
+            return False
+        srcinfo.counter.inc("miss")
+
+        log.logger.info(f"Syncing {self.srcinfo_path}")
+        self.gensrcinfo(verify)
+
+        # cache srcinfo
+        with open(self.srcinfo_path, "w") as f:
+            log.logger.debug(f"Write srcinfo {self.srcinfo_path}")
+            f.write(self._srcinfo)
+
+        # cache pkghash
+        with open(self.pkghash_path, "w") as f:
+            log.logger.debug(f"Write pkghash {self.pkghash_path}")
+            f.write(pkghash)
+
+        self.catalog.put(self.pkgpath, self.parsesrcinfo(self._srcinfo))
+        return True
 
     @property
     def srcinfo(self):
@@ -383,12 +703,35 @@ class Pkgbuild:
                     if provide == pkgname:
                         return pkg
 
-    def build(self, force=False, skippgpcheck=False, skipchecksum=False, skipinteg=False, noconfirm=False, ignorearch=False):
-        hasall = True
-        self._pkgsrc = None
+    def hasartifacts(self):
         for artifact in self.artifacts:
             if not os.path.exists(os.path.join(self.distpath, artifact)):
-                hasall = False
+                return False
+        return True
+
+    def prefetch(self, skipinteg=False, skippgpcheck=False):
+        # download and verify the sources to SRCDEST only, so that the build does not wait for the network
+        args = []
+        if skipinteg:
+            args.append("--skipinteg")
+        if skippgpcheck:
+            args.append("--skippgpcheck")
+        t1 = time.time()
+        self.linkstore()
+        self.syncmirrors()
+        try:
+            self.container.run_stdout("makepkg", "--verifysource", "--nodeps", "--ignorearch", *args,
+                                      cwd=self.pkgfullpath, env=self.env)
+        except OSError:
+            log.logger.warning(f"Can not prefetch sources of {self.refname}, they will be downloaded by the build")
+            return False
+        self.fillstore()
+        log.logger.info(f"Prefetched sources of {self.refname} in {time.time() - t1:.2f} seconds")
+        return True
+
+    def build(self, force=False, skippgpcheck=False, skipchecksum=False, skipinteg=False, noconfirm=False, ignorearch=False):
+        self._pkgsrc = None
+        hasall = self.hasartifacts()
 
         if force and not self.forcebuilt:
             self.forcebuilt = True
@@ -403,12 +746,10 @@ class Pkgbuild:
             return
         else:
             # remove existing artifacts since all artifacts will be rebuilt
-            for fname in os.listdir(self.distpath):
-                pkgname, _, _ = Package.fnameparse(fname)
-                if not pkgname:
-                    continue
-                if pkgname in self.pkgname:
-                    cmd.run_stdout("rm", os.path.join(self.distpath, fname))
+            for package in self.pkgname:
+                for artifact in self.artifactindex.get(package.pkgname):
+                    cmd.run_stdout("rm", os.path.join(self.distpath, artifact.fname))
+            self.artifactindex.invalidate()
 
         # parse makepkg flags
         args = []
@@ -425,7 +766,32 @@ class Pkgbuild:
         if ignorearch:
             args.append(f"--ignorearch")
 
-        retval = self.container.run_interactive("makepkg", "-s", *args, cwd=self.pkgfullpath, env=self.env)
+        self.linkstore()
+        self.syncmirrors()
+        env = self.env.copy()
+        env.update(jobserver.env())
+        # throwaway build files go to tmpfs if they fit, as they did in the last build
+        buildpath = self.buildpath
+        budget = tmpfs.budget()
+        reserved = budget.reserve(tmpfs.readfootprint(self.footprint_path)) if budget else 0
+        if reserved:
+            buildpath = os.path.join(budget.path, defs.BUILD_PATH_NAME, self.container.name, self.remotename)
+            os.makedirs(buildpath, exist_ok=True)
+            env["BUILDDIR"] = buildpath
+            log.logger.info(f"Building {self.refname} on tmpfs")
+        builddir = os.path.join(buildpath, self.pkgbase.pkgname)
+        try:
+            retval = self.container.run_interactive("makepkg", "-s", *args, cwd=self.pkgfullpath, env=env,
+                                                    **self.container.buildargs(self))
+        finally:
+            # the footprint is learned only when tmpfs is used, walking a big build tree is not free
+            size = dirsize(builddir) if budget else 0
+            if size:
+                tmpfs.writefootprint(self.footprint_path, size)
+            if reserved:
+                cmd.run_stdout("rm", "-rf", builddir)
+                budget.release(reserved, size)
+        self.fillstore()
         # remove unwanted chars from the artifact name
         for package in self.pkgname:
             artifact_orig = self.getartifact(package, False, False)
@@ -436,43 +802,24 @@ class Pkgbuild:
             artifact_new = self.getartifact(package, False, True)
             if not artifact_orig == artifact_new:
                 self.container.run_stdout("mv", "-f", artifact_orig, artifact_new)
+        self.artifactindex.invalidate()
         self.sync(skipinteg, skippgpcheck, False)
         self.parse()
         return retval
 
+    def iterartifacts(self, package):
+        # latest first, only the package files that can be installed to the container
+        for artifact in reversed(self.artifactindex.get(package.pkgname)):
+            if artifact.ext == self.container.pkgext and artifact.arch in ["any", self.container.cont_arch]:
+                yield artifact
+
     def hasartifact(self, package):
-        latest = None
-        for fname in os.listdir(self.distpath):
-            segments = fname.split("-")
-            if len(segments) > 1 and fname.endswith(self.container.pkgext):
-                name = "-".join(segments[:-1])
-                arch = segments[-1].split(".")
-                if arch:
-                    arch = arch[0]
-                    if name.startswith(package.pkgname) and arch in ["any", self.container.cont_arch]:
-                        vers = name[len(package.pkgname) + 1:]
-                        if not vers.startswith("debug-"):
-                            newvers = version.Version(vers)
-                            if not latest:
-                                latest = newvers
-                            elif newvers.compare(defs.COMP_G, latest):
-                                latest = newvers
-        return latest
+        for artifact in self.iterartifacts(package):
+            return artifact.version
 
     def latestbuild(self, package):
-        artifact_ver = None
-        artifact = None
-        for fname in os.listdir(self.distpath):
-            pkgname, pkgver, pkgrel = Package.fnameparse(fname)
-            if not pkgname == package.pkgname:
-                continue
-            fname = os.path.join(self.distpath, fname)
-            ver = version.Version(f"{pkgver}.{pkgrel}")
-            if not artifact_ver or ver.compare(defs.COMP_GE, artifact_ver):
-                artifact = fname
-                artifact_ver = ver
-
-        return artifact
+        for artifact in self.iterartifacts(package):
+            return os.path.join(self.distpath, artifact.fname)
 
     def getartifact(self, package, checkexists=True, filterchars=True):
         if package.pkgname not in self.pkgname:
@@ -520,7 +867,18 @@ class Pkgbuild:
             installs.append(f"--noconfirm")
 
         # install with pacman
-        return self.container.run_interactive("sudo", "pacman", "-U", *installs, cwd=self.distpath)
+        return self.container.run_interactive(*pacman("-U", *installs), cwd=self.distpath)
+
+    def sourcehosts(self):
+        # hosts the sources are downloaded from, local files have none
+        hosts = []
+        for k, v in self.itersrcinfo():
+            if k != "source" and not k.startswith("source_"):
+                continue
+            host = urllib.parse.urlsplit(v.split("::", 1)[-1]).hostname
+            if host and host not in hosts:
+                hosts.append(host)
+        return hosts
 
     def dlagents(self):
         dlagents = []
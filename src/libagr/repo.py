@@ -4,6 +4,7 @@ Created on Jan 30, 2024
 @author: boogie
 '''
 import os
+import threading
 import traceback
 from multiprocessing import pool
 from libagr import config
@@ -13,32 +14,138 @@ from libagr import log
 from libagr import pkgbuild
 from libagr import cache
 from libagr import autorel
+from libagr import catalog
+from libagr import jobserver
+from libagr import tmpfs
+
+
+META_PROCESSED = "processed"
 
 
 def iterpkgpaths(rname):
     rpath = git.repopath(rname)
-    for root, _subdirs, files in os.walk(rpath, followlinks=False):
+    for root, subdirs, files in os.walk(rpath, followlinks=False):
+        # git internals can be huge and never contain packages
+        if ".git" in subdirs:
+            subdirs.remove(".git")
         if defs.IGNORE_FLAG in files or defs.PKGBUILD not in files:
             continue
         pkgpath = os.path.relpath(root, rpath)
         yield pkgpath
 
 
-def tempsync(pkgbuilds):
+def tempsync(pkgbuilds, verify=False):
     def _tempsync(pkgb):
+        # pkgbuilds are already parsed from the cache if it is valid
+        if not pkgb.syncsrcinfo(verify):
+            return
         log.logger.info(f"Parsing {pkgb}")
-        pkgb.gensrcinfo()
         try:
             pkgb.parse()
         except Exception:
             log.logger.warning(f"Can not parse package: {pkgb}")
             log.logger.debug(traceback.format_exc())
 
-    with pool.ThreadPool(min(defs.NUMCORES, 8)) as p:
+    with pool.ThreadPool(defs.NUMCORES) as p:
         p.map(_tempsync, pkgbuilds)
     return pkgbuilds
 
 
+def syncstate(container, rname):
+    # everything the srcinfo cache of a remote depends on, other than the package contents
+    heads = {".": git.readhead(git.repopath(rname))}
+    for path, (kind, _sha) in catalog.getcatalog(rname).treeids.items():
+        if kind == "commit":
+            heads[path] = git.readhead(git.repopkgpath(rname, path))
+    return {"container": container.name, "srcinfolib": pkgbuild.srcinfolibhash(), "heads": heads}
+
+
+def changedpaths(rname, processed, state):
+    # paths changed since the processed state, None if everything needs processing
+    if not processed or any([processed.get(x) != state[x] for x in ["container", "srcinfolib"]]):
+        return
+    old = processed["heads"]
+    new = state["heads"]
+    paths = []
+    if old.get(".") != new["."]:
+        if not old.get(".") or not new["."]:
+            return
+        try:
+            paths.extend(git.changedpaths(git.repopath(rname), old["."], new["."]))
+        except OSError:
+            return
+    for path in set(old) | set(new):
+        if path != "." and old.get(path) != new.get(path):
+            paths.append(path)
+    return paths
+
+
+def istouched(pkgpath, paths):
+    for path in paths:
+        if pkgpath == "." or path == pkgpath or path.startswith(f"{pkgpath}/") or pkgpath.startswith(f"{path}/"):
+            return True
+    return False
+
+
+def syncpkgbuilds(container, verify=False):
+    # regenerate the srcinfo of only the packages touched since the last processed sync
+    states = {}
+    changes = {}
+    pkgbuilds = []
+    for pkgb in allpkgbuilds(container):
+        rname = pkgb.remotename
+        if rname not in states:
+            states[rname] = syncstate(container, rname)
+            processed = catalog.getcatalog(rname).getmeta(META_PROCESSED)
+            changes[rname] = None if verify else changedpaths(rname, processed, states[rname])
+            if changes[rname] is not None:
+                log.logger.debug(f"Changed paths in {rname}: {changes[rname]}")
+        paths = changes[rname]
+        if paths is None or not os.path.exists(pkgb.srcinfo_path) or istouched(pkgb.pkgpath, paths):
+            pkgbuilds.append(pkgb)
+    tempsync(pkgbuilds, verify)
+    for rname, state in states.items():
+        catalog.getcatalog(rname).setmeta(META_PROCESSED, state)
+    return pkgbuilds
+
+
+def syncsources(container, pkgbuilds, skipinteg=False, skippgpcheck=False, jobs=defs.SOURCE_JOBS, hostjobs=defs.SOURCE_HOST_JOBS,
+                fast=True):
+    # download the sources of dynamic packages concurrently, with at most hostjobs downloads from the same host
+    # returns the pkgbuilds that failed
+    lock = threading.Lock()
+    semaphores = {}
+
+    def _syncsource(pkgb):
+        try:
+            hosts = sorted(pkgb.sourcehosts()) if pkgb.isdynamic and hostjobs else []
+        except Exception:
+            # the sync reports the broken package
+            hosts = []
+        with lock:
+            hostlocks = [semaphores.setdefault(x, threading.BoundedSemaphore(hostjobs)) for x in hosts]
+        # always taken in the same order, so two packages can not wait for each other
+        for hostlock in hostlocks:
+            hostlock.acquire()
+        try:
+            pkgb.sync(skipinteg, skippgpcheck, fast=fast)
+            return pkgb.isbroken
+        except Exception:
+            log.logger.warning(f"Error syncing {pkgb.refname} check {defs.PKGBUILD}")
+            log.logger.debug(traceback.format_exc())
+            return True
+        finally:
+            for hostlock in reversed(hostlocks):
+                hostlock.release()
+
+    if not pkgbuilds:
+        return []
+    jobs = min(jobs, container.maxjobs or jobs)
+    with pool.ThreadPool(max(1, min(jobs, len(pkgbuilds)))) as p:
+        failed = p.map(_syncsource, pkgbuilds)
+    return [pkgb for pkgb, isfailed in zip(pkgbuilds, failed) if isfailed]
+
+
 def iterpkgbuilds(repo=None, no_repo=None):
     repo = repo or []
     no_repo = no_repo or []
@@ -62,125 +169,294 @@ def allpkgbuilds(container, repo=None, no_repo=None):
     return pkgbuilds
 
 
-def getpackages(container, pkgnames, repo=None, no_repo=None):
-    result = []
-    for pkgb in allpkgbuilds(container, repo, no_repo):
+class Resolver:
+    # resolves the agr packages to build from a name/provides index of all pkgbuilds in the allowed repos
+    def __init__(self, container, repo=None, no_repo=None, agrfirst=False, noconfirm=False):
+        self.container = container
+        self.agrfirst = agrfirst
+        self.noconfirm = noconfirm
+        self.pkgbuilds = allpkgbuilds(container, repo, no_repo)
+        self.providers = {}
+        self.alternatives = {}
+        self.versions = {}
+        self.cycles = []
+        for pkgb in self.pkgbuilds:
+            for pkgname in pkgb.pkgnames:
+                providers = self.providers.setdefault(pkgname.pkgname, [])
+                if pkgb not in providers:
+                    providers.append(pkgb)
+
+    def getpackages(self, pkgnames):
         if pkgnames == defs.FILTER_NONE:
-            continue
+            return []
         elif pkgnames == defs.FILTER_ALL:
-            result.extend(pkgb.pkgname)
-            continue
+            return [x for pkgb in self.pkgbuilds for x in pkgb.pkgname]
+        result = []
         for pkgname in pkgnames:
-            package = pkgb.getpackage(pkgname)
-            if package and package not in result:
+            for pkgb in self.providers.get(pkgname, []):
                 package = pkgb.getpackage(pkgname)
-                result.append(package)
-    return result
-
-
-def select_alts(container, package, repo=None, no_repo=None, agrfirst=False, noconfirm=False, pacman=True):
-    # search in agr
-    found_agr_deps = []
+                if package and package not in result:
+                    result.append(package)
+        return result
+
+    def satisfies(self, alt, package):
+        if not package.compare or not alt.compare:
+            return True
+        key = (alt.version.version, package.compare, package.version.version)
+        if key not in self.versions:
+            self.versions[key] = alt.version.compare(package.compare, package.version)
+        return self.versions[key]
+
+    def select(self, package):
+        # selection is asked once per dependency, and reused in the whole resolution
+        key = str(package)
+        if key not in self.alternatives:
+            self.alternatives[key] = self.select_alts(package)
+        return self.alternatives[key]
+
+    def select_alts(self, package):
+        # search in agr
+        found_agr_deps = []
+
+        # search in pacman
+        found_sys_deps = []
+
+        # check if the found alternative satisfies the package version dependency
+        for dest, source in [(found_agr_deps, self.getpackages([package.pkgname])),
+                             (found_sys_deps, self.container.available.get(package, []))]:
+            for alt in source:
+                if not self.satisfies(alt, package):
+                    log.logger.debug(f"{alt}{alt.version.compare}{alt.version.version} does not satify {package}{package.version.compare}{package.version.version}")
+                    continue
+                dest.append(alt)
+
+        # select the alternative
+        if not len(found_agr_deps) and not len(found_sys_deps):
+            return  # no package available
+        elif len(found_agr_deps) == 1 and not len(found_sys_deps):
+            return found_agr_deps[0]
+        elif len(found_sys_deps) and not len(found_agr_deps):
+            return found_sys_deps[0]  # let the pacman/makepkg choose
+        elif self.noconfirm:
+            return found_agr_deps[0] if len(found_agr_deps) and (self.agrfirst or not len(found_sys_deps)) else found_sys_deps[0]
+        else:
+            msgs = []
+            if len(found_agr_deps):
+                msgs.append(f"{len(found_agr_deps)} AGR")
+            if len(found_sys_deps):
+                msgs.append(f"{len(found_sys_deps)} PACMAN")
+            log.logger.info(f"Found " + ",".join(msgs) + f" candidates for package '{package.pkgname}'")
+            log.logger.info("Please select which variant to use")
+            index = 0
+            pacmanopt = None
+            for alternative in found_agr_deps:
+                index += 1
+                log.logger.info(f"{index}) AGR: {alternative.pkgbuild.remotename}: {alternative.pkgname}")
+            if len(found_sys_deps):
+                index += 1
+                pacmanopt = index
+                log.logger.info(f"{index}) Let pacman choose from {found_sys_deps}")
+            defval = pacmanopt if pacmanopt is not None and not self.agrfirst else 0
+            offset = defval
+            while True:
+                offset = input(f"Enter a number in between 1-{index}, (Default: {defval}): ")
+                if offset.isdigit() and int(offset) > 0 and int(offset) <= index:
+                    offset = int(offset) - 1
+                    break
+                elif offset.strip() == "":
+                    offset = defval
+                    break
+            return found_agr_deps[offset] if offset < len(found_agr_deps) else found_sys_deps[0]
+
+    def getdeps(self, package, no_packages):
+        # agr packages needed to build and install the package, pacman resolves the rest by itself
+        deps = []
+        for dep in package.pkgbuild.depends.get(package, []) + package.pkgbuild.makedepends:
+            if dep in no_packages:
+                continue
+            alternative = self.select(dep)
+            if alternative and alternative.pkgbuild and alternative not in deps:
+                deps.append(alternative)
+        return deps
+
+    def sysdeps(self, pkgbuild, no_packages):
+        # repo packages needed to build and install the packages of a pkgbuild, makepkg installs them
+        deps = []
+        for package in pkgbuild.pkgname:
+            for dep in pkgbuild.depends.get(package, []) + pkgbuild.makedepends:
+                if dep in no_packages:
+                    continue
+                alternative = self.select(dep)
+                if alternative and not alternative.pkgbuild and alternative not in deps:
+                    deps.append(alternative)
+        return deps
+
+    def resolve(self, packages, no_packages=None):
+        # depth first walk over depends and makedepends, returns the build plan with the dependencies first
+        # and the set of packages that are a dependency of another package in the plan
+        no_packages = set(no_packages or [])
+        plan = []
+        required = set()
+        visited = set()
+        for root in packages:
+            if root in visited or root in no_packages:
+                continue
+            visited.add(root)
+            path = [root]
+            onpath = {root}
+            stack = [iter(self.getdeps(root, no_packages))]
+            while stack:
+                for dep in stack[-1]:
+                    required.add(dep)
+                    if dep in onpath:
+                        cycle = path[path.index(dep):] + [dep]
+                        self.cycles.append(cycle)
+                        log.logger.warning(f"Dependency cycle: {' -> '.join([x.pkgname for x in cycle])}")
+                    elif dep not in visited:
+                        visited.add(dep)
+                        path.append(dep)
+                        onpath.add(dep)
+                        stack.append(iter(self.getdeps(dep, no_packages)))
+                        break
+                else:
+                    stack.pop()
+                    onpath.remove(path[-1])
+                    plan.append(path.pop())
+        return plan, required
 
-    # search in pacman
-    found_sys_deps = []
 
-    # total_alts = found_agr_deps + found_sys_deps if agrfirst else found_sys_deps + found_agr_deps
+@cache.Cache.runonce
+def _getresolver(container, repo, no_repo, agrfirst, noconfirm):
+    return Resolver(container, repo, no_repo, agrfirst, noconfirm)
 
-    # check if the found alternative satisfies the package version dependency
-    # filtered_alts = []
-    for dest, source in [(found_agr_deps, getpackages(container, [package.pkgname], repo, no_repo)),
-                         (found_sys_deps, container.available.get(package, []))]:
-        for alt in source:
-            if alt.version is None:
-                pass
-            if package.compare and alt.compare and not alt.version.compare(package.compare, package.version):
-                log.logger.debug(f"{alt}{alt.version.compare}{alt.version.version} does not satify {package}{package.version.compare}{package.version.version}")
-                continue
-            dest.append(alt)
-
-    # select the alternative
-    if not len(found_agr_deps) and not len(found_sys_deps):
-        return  # no package available
-    elif len(found_agr_deps) == 1 and not len(found_sys_deps):
-        return found_agr_deps[0]
-    elif len(found_sys_deps) and not len(found_agr_deps):
-        return found_sys_deps[0]  # let the pacman/makepkg choose
-    elif noconfirm:
-        return found_agr_deps[0] if len(found_agr_deps) and (agrfirst or not len(found_sys_deps)) else found_sys_deps[0]
-    else:
-        msgs = []
-        if len(found_agr_deps):
-            msgs.append(f"{len(found_agr_deps)} AGR")
-        if len(found_sys_deps):
-            msgs.append(f"{len(found_sys_deps)} PACMAN")
-        log.logger.info(f"Found " + ",".join(msgs) + f" candidates for package '{package.pkgname}'")
-        log.logger.info("Please select which variant to use")
-        index = 0
-        pacmanopt = None
-        for alternative in found_agr_deps:
-            index += 1
-            log.logger.info(f"{index}) AGR: {alternative.pkgbuild.remotename}: {alternative.pkgname}")
-        if len(found_sys_deps):
-            index += 1
-            pacmanopt = index
-            log.logger.info(f"{index}) Let pacman choose from {found_sys_deps}")
-        defval = pacmanopt if pacmanopt is not None and not agrfirst else 0
-        offset = defval
-        while True:
-            offset = input(f"Enter a number in between 1-{index}, (Default: {defval}): ")
-            if offset.isdigit() and int(offset) > 0 and int(offset) <= index:
-                offset = int(offset) - 1
-                break
-            elif offset.strip() == "":
-                offset = defval
-                break
-        return found_agr_deps[offset] if offset < len(found_agr_deps) else found_sys_deps[0]
 
+def getresolver(container, repo=None, no_repo=None, agrfirst=False, noconfirm=False):
+    # the resolver is cached on the str of its args, they are normalized so that the callers share its caches
+    # and the alternatives are asked once
+    return _getresolver(container, repo or None, no_repo or None, bool(agrfirst), bool(noconfirm))
 
-def getdeps(container, packages, no_packages=None, repo=None, no_repo=None, agrfirst=False, noconfirm=False, make=False, excludes=None, alternatives=None):
-    no_packages = no_packages or []
-    excludes = excludes or []
-    if alternatives is None:
-        alternatives = {}
-    deps = []
 
-    for package in packages:
-        if package in no_packages:
-            continue
-        if package.pkgbuild:
-            for dep in package.pkgbuild.makedepends if make else package.pkgbuild.depends.get(package, []):
-                if dep in no_packages:
-                    continue
-                if dep in alternatives:
-                    alternative = alternatives[dep]
-                else:
-                    alternative = select_alts(container, dep, repo, no_repo, agrfirst, noconfirm, False)
-                    if alternative:
-                        alternatives[dep] = alternative
-                if not alternative or alternative.pkgbuild is None:
-                    # pacman package, dead code?
+def getpackages(container, pkgnames, repo=None, no_repo=None):
+    return getresolver(container, repo, no_repo, False, False).getpackages(pkgnames)
+
+
+def select_alts(container, package, repo=None, no_repo=None, agrfirst=False, noconfirm=False):
+    return getresolver(container, repo, no_repo, agrfirst, noconfirm).select(package)
+
+
+def schedule(nodes, prereqs, action, jobs=defs.BUILD_JOBS):
+    # runs the action of each node as soon as all of its prerequisites succeeded, at most jobs at a time
+    # returns {node: retval of action}, nodes depending on a failed node are not run and are None
+    pending = {}
+    dependants = {}
+    nodeset = set(nodes)
+    for node in nodes:
+        pending[node] = set([x for x in prereqs(node) if x in nodeset and x != node])
+        for prereq in pending[node]:
+            dependants.setdefault(prereq, []).append(node)
+    results = {}
+    ready = [x for x in nodes if not pending[x]]
+    running = []
+    cond = threading.Condition()
+
+    def skip(node, reason):
+        for dependant in dependants.get(node, []):
+            if dependant in pending:
+                log.logger.warning(f"Skipping {dependant}, because {reason} failed")
+                pending.pop(dependant)
+                results[dependant] = None
+                skip(dependant, reason)
+
+    def run(node):
+        try:
+            retval = action(node)
+        except Exception:
+            log.logger.error(f"Error processing {node}")
+            log.logger.debug(traceback.format_exc())
+            retval = False
+        with cond:
+            running.remove(node)
+            results[node] = retval
+            if retval is False:
+                skip(node, node)
+            else:
+                for dependant in dependants.get(node, []):
+                    if dependant in pending:
+                        pending[dependant].discard(node)
+                        if not pending[dependant]:
+                            pending.pop(dependant)
+                            ready.append(dependant)
+            cond.notify()
+
+    for node in ready:
+        pending.pop(node)
+    with pool.ThreadPool(max(1, jobs)) as p:
+        with cond:
+            while ready or running or pending:
+                while ready and len(running) < jobs:
+                    node = ready.pop(0)
+                    running.append(node)
+                    p.apply_async(run, (node,))
+                if not ready and not running and pending:
+                    # only a dependency cycle can leave nodes behind, start the least blocked one
+                    node = min(pending, key=lambda x: len(pending[x]))
+                    log.logger.warning(f"Starting {node} before {list(pending[node])} due to a dependency cycle")
+                    pending.pop(node)
+                    ready.append(node)
                     continue
-                if alternative not in excludes:
-                    excludes.append(alternative)
-                    if alternative not in deps:
-                        deps.append(alternative)
-    if deps:
-        subdeps = getdeps(container, deps, no_packages, repo, no_repo, agrfirst, noconfirm, make, excludes, alternatives)
-        if subdeps:
-            deps = subdeps + deps
-    return deps
+                cond.wait()
+    return results
+
+
+class Prefetcher:
+    # downloads the sources of the pkgbuilds in build order while the earlier ones are being built
+    def __init__(self, pkgbuilds, jobs=defs.PREFETCH_JOBS, skipinteg=False, skippgpcheck=False):
+        self.queue = []
+        for pkgb in pkgbuilds:
+            if pkgb not in self.queue:
+                self.queue.append(pkgb)
+        self.skipinteg = skipinteg
+        self.skippgpcheck = skippgpcheck
+        self.lock = threading.Lock()
+        self.running = {}
+        self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(min(jobs, len(self.queue)))]
+        for thread in self.threads:
+            thread.start()
+
+    def worker(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    return
+                pkgb = self.queue.pop(0)
+                done = self.running[pkgb] = threading.Event()
+            try:
+                pkgb.prefetch(self.skipinteg, self.skippgpcheck)
+            finally:
+                done.set()
+
+    def wait(self, pkgb):
+        # makepkg of the build and the prefetch must not work on the same SRCDEST at the same time
+        with self.lock:
+            if pkgb in self.queue:
+                self.queue.remove(pkgb)
+                return
+            done = self.running.get(pkgb)
+        if done:
+            done.wait()
+
+    def close(self):
+        with self.lock:
+            self.queue = []
+        for thread in self.threads:
+            thread.join()
 
 
 def buildpkgs(container, packages, no_packages=None, repo=None, no_repo=None, agrfirst=False, skippgpcheck=False,
-              skipchecksum=False, skipinteg=False, noconfirm=False, force=False, ignorearch=False):
-    # depends
-    bases, deps = resolvepkgs(container, packages, no_packages, repo, no_repo, agrfirst, noconfirm, False)
-    # make_depends
-    _, make_deps = resolvepkgs(container, packages, no_packages, repo, no_repo, agrfirst, noconfirm, True)
-    for dep in make_deps:
-        if dep not in deps and dep not in bases:
-            deps.append(dep)
+              skipchecksum=False, skipinteg=False, noconfirm=False, force=False, ignorearch=False, jobs=defs.BUILD_JOBS,
+              cores=defs.BUILD_CORES, prefetch=defs.PREFETCH_JOBS, tmpfsbudget=defs.TMPFS_BUDGET):
+    no_packages = no_packages or []
+    bases, deps = resolvepkgs(container, packages, no_packages, repo, no_repo, agrfirst, noconfirm)
 
     # if dep is also in base packages, first build it and then install it
     basedeps = []
@@ -189,52 +465,112 @@ def buildpkgs(container, packages, no_packages=None, repo=None, no_repo=None, ag
             deps.remove(base)
             basedeps.append(base)
 
-    agr_installs, _sys_installs = needsinstall(container, deps, repo=repo, no_repo=no_repo, agrfirst=agrfirst, noconfirm=noconfirm)
+    installs = needsinstall(container, deps, repo=repo, no_repo=no_repo, agrfirst=agrfirst, noconfirm=noconfirm)
+    if installs is None:
+        return False
+    agr_installs, _sys_installs = installs
     if agr_installs:
         log.logger.info(f"Installing dependecies from agr: {agr_installs}")
-    if not installpkgs(container, agr_installs, skippgpcheck, skipchecksum, skipinteg, noconfirm, force, ignorearch):
-        return False
-    for base_package in bases:
-        git.syncremote(base_package.pkgbuild.remotename)
-        if not base_package.pkgbuild:
-            continue
-        artifact = base_package.pkgbuild.getartifact(base_package)
-        build = True
-        if artifact and not force:
-            build = False
-            if container.name == defs.CONTAINER_NATIVE:
-                try:
-                    artifact = base_package.pkgbuild.latestbuild(base_package)
-                    autorel.syncsysdeps(container, base_package, noconfirm, agr_installs)
-                except Exception as e:
-                    log.logger.warning("Can not analyse %s, assuming it is already built without any issue, Error:%s",
-                                       base_package, e)
+
+    # split packages share the pkgbuild, they are built once and one at a time
+    locks = {}
+    for package in agr_installs + bases:
+        locks.setdefault(package.pkgbuild, threading.Lock())
+
+    def installdep(package):
+        with locks[package.pkgbuild]:
+            prefetcher.wait(package.pkgbuild)
+            return installpkgs(container, [package], skippgpcheck, skipchecksum, skipinteg, noconfirm, force, ignorearch)
+
+    def buildbase(base_package):
+        with locks[base_package.pkgbuild]:
+            prefetcher.wait(base_package.pkgbuild)
+            return buildbasepkg(container, base_package, basedeps, agr_installs, skippgpcheck, skipchecksum, skipinteg,
+                                noconfirm, force, ignorearch)
+
+    # installed dependencies are not scheduled, wait for what they depend on instead
+    resolver = getresolver(container, repo, no_repo, agrfirst, noconfirm)
+    nodes = set(agr_installs + bases)
+    for pkgb in set([x.pkgbuild for x in nodes]):
+        pkgb.sysdeps = resolver.sysdeps(pkgb, no_packages)
+
+    def prereqs(package):
+        found = set()
+        visited = set()
+        stack = [package]
+        while stack:
+            for dep in resolver.getdeps(stack.pop(), no_packages):
+                if dep in visited:
+                    continue
+                visited.add(dep)
+                if dep in nodes:
+                    found.add(dep)
                 else:
-                    if autorel.checkpkg(artifact) == autorel.DEP_OLD:
-                        build = True
-            if build:
-                # bump pkgrel since deps has newer verions and pkg needs rebuilding
-                base_package.pkgbuild.pkgrel += 1
-            else:
-                # release is built and usable, no need to rebuild
-                log.logger.info(f"already built, {artifact}")
-
-        if build and base_package.pkgbuild.build(force,
-                                                 skippgpcheck,
-                                                 skipchecksum,
-                                                 skipinteg,
-                                                 noconfirm,
-                                                 ignorearch) is False:
-            log.logger.error(f"Error building {base_package}")
-            return False
+                    stack.append(dep)
+        return found
+
+    # the packages already built are not downloaded again, makepkg of a container can not run next to a build
+    prefetches = [x.pkgbuild for x in agr_installs + bases if force or not x.pkgbuild.hasartifacts()]
+    prefetcher = Prefetcher(prefetches if container.maxjobs is None else [], prefetch, skipinteg, skippgpcheck)
+
+    depnodes = set(agr_installs)
+    jobs = min(jobs, container.maxjobs or jobs)
+    # concurrent builds share the cores instead of each using all of them
+    try:
+        with jobserver.Jobserver(cores, jobs), tmpfs.Budget(tmpfsbudget * 1024 ** 2):
+            results = schedule(agr_installs + bases, prereqs,
+                               lambda x: installdep(x) if x in depnodes else buildbase(x), jobs)
+    finally:
+        prefetcher.close()
+    failed = [x for x, retval in results.items() if retval is False]
+    skipped = [x for x, retval in results.items() if retval is None]
+    if failed or skipped:
+        log.logger.error(f"Failed: {failed}, skipped: {skipped}")
+        return False
+    return packages
 
-        # install previously built package if it was in deps list
-        if base_package in basedeps and not base_package.isinstalled(container):
-            if not installpkgs(container, [base_package], skippgpcheck, skipchecksum, skipinteg, noconfirm, force, ignorearch):
-                return False
-            agr_installs.append(base_package)
 
-    return packages
+def buildbasepkg(container, base_package, basedeps, agr_installs, skippgpcheck=False, skipchecksum=False, skipinteg=False,
+                 noconfirm=False, force=False, ignorearch=False):
+    git.syncremote(base_package.pkgbuild.remotename)
+    if not base_package.pkgbuild:
+        return True
+    artifact = base_package.pkgbuild.getartifact(base_package)
+    build = True
+    if artifact and not force:
+        build = False
+        if container.name == defs.CONTAINER_NATIVE:
+            try:
+                artifact = base_package.pkgbuild.latestbuild(base_package)
+                autorel.syncsysdeps(container, base_package, noconfirm, agr_installs)
+            except Exception as e:
+                log.logger.warning("Can not analyse %s, assuming it is already built without any issue, Error:%s",
+                                   base_package, e)
+            else:
+                if autorel.checkpkg(artifact) == autorel.DEP_OLD:
+                    build = True
+        if build:
+            # bump pkgrel since deps has newer verions and pkg needs rebuilding
+            base_package.pkgbuild.pkgrel += 1
+        else:
+            # release is built and usable, no need to rebuild
+            log.logger.info(f"already built, {artifact}")
+
+    if build and base_package.pkgbuild.build(force,
+                                             skippgpcheck,
+                                             skipchecksum,
+                                             skipinteg,
+                                             noconfirm,
+                                             ignorearch) is False:
+        log.logger.error(f"Error building {base_package}")
+        return False
+
+    # install previously built package if it was in deps list
+    if base_package in basedeps and not base_package.isinstalled(container):
+        if not installpkgs(container, [base_package], skippgpcheck, skipchecksum, skipinteg, noconfirm, force, ignorearch):
+            return False
+        agr_installs.append(base_package)
+    return True
 
 
 def installpkgs(container, packages, skippgpcheck=False, skipchecksum=False, skipinteg=False,
@@ -247,7 +583,7 @@ def installpkgs(container, packages, skippgpcheck=False, skipchecksum=False, ski
             log.logger.error(f"Error building {package}")
             return False
         artifact = package.pkgbuild.getartifact(package)
-        pacmancmd = ["sudo", "pacman", "-U", artifact]
+        pacmancmd = pkgbuild.pacman("-U", artifact)
         kwargs = {}
         if noconfirm:
             pacmancmd.append("--noconfirm")
@@ -259,7 +595,7 @@ def installpkgs(container, packages, skippgpcheck=False, skipchecksum=False, ski
     return True
 
 
-def needsinstall(container, packages, repo=None, no_repo=None, agrfirst=None, noconfirm=None):
+def needsinstall(container, packages, repo=None, no_repo=None, agrfirst=False, noconfirm=False):
     agr_installs = []
     sys_installs = []
     for package in packages:
@@ -287,33 +623,23 @@ def filterpkgs(container, pkg=None, repo=None, no_pkg=None, no_repo=None, agrfir
     no_packages = getpackages(container, no_pkg or defs.FILTER_NONE, repo or defs.FILTER_ALL, no_repo=no_repo or defs.FILTER_NONE)
     if pkg or no_pkg or repo or no_repo:
         pkgbs = []
-        for make in [True, False]:
-            bases, deps = resolvepkgs(container, packages, no_packages, repo, no_repo, agrfirst, noconfirm, make)
-            for pkgb in set(bases + deps):
-                if pkgb.pkgbuild and pkgb.pkgbuild not in pkgbs:
-                    pkgbs.append(pkgb.pkgbuild)
+        bases, deps = resolvepkgs(container, packages, no_packages, repo, no_repo, agrfirst, noconfirm)
+        for package in bases + deps:
+            if package.pkgbuild not in pkgbs:
+                pkgbs.append(package.pkgbuild)
     else:
         pkgbs = allpkgbuilds(container)
     return pkgbs, packages, no_packages
 
 
-def resolvepkgs(container, packages, no_packages=None, repo=None, no_repo=None, agrfirst=False, noconfirm=False, make=False):
-    # get all packages in allowed repos with all its dependencies
-    deps = []
+def resolvepkgs(container, packages, no_packages=None, repo=None, no_repo=None, agrfirst=False, noconfirm=False):
+    # get all packages in allowed repos with all its dependencies, both are sorted with the dependencies first
+    no_packages = no_packages or []
     bases = []
-    alternatives = {}
     for package in packages:
-        pkgnames = []
         for base in package.pkgbuild.pkgname:
             if base not in bases and base not in no_packages:
-                pkgnames.append(base)
-        bases.extend(pkgnames)
-        for pkgdep in getdeps(container, pkgnames, no_packages, repo, no_repo, agrfirst, noconfirm, make, alternatives=alternatives):
-            if pkgdep not in deps:
-                deps.append(pkgdep)
-
-    for dep in reversed(deps):
-        if dep in bases:
-            bases.insert(0, bases.pop(bases.index(dep)))
-
-    return bases, deps
+                bases.append(base)
+    plan, required = getresolver(container, repo, no_repo, agrfirst, noconfirm).resolve(bases, no_packages)
+    bases = set(bases)
+    return [x for x in plan if x in bases], [x for x in plan if x in required]
@@ -0,0 +1,135 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import os
+import stat
+
+from libagr import alpm
+
+
+OPAQUE_XATTRS = ["trusted.overlay.opaque", "user.overlay.opaque"]
+
+
+def iswhiteout(path):
+    # overlayfs marks the files deleted from the lower layers with a 0:0 character device in the upper layer
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISCHR(st.st_mode) and st.st_rdev == 0
+
+
+def isopaque(path):
+    # an opaque upper dir hides the whole lower dir, trusted xattrs are only readable by root, when they can not be
+    # read the lower dir is merged, pacman recreates the dirs it removes with all of their files anyway
+    for xattr in OPAQUE_XATTRS:
+        try:
+            if os.getxattr(path, xattr) == b"y":
+                return True
+        except OSError:
+            pass
+    return False
+
+
+class View:
+    # the file view of a container from the host, as systemd-nspawn mounts it. mounts are container paths mapped to
+    # the host paths layered on them, upper first, the rest of the container is the rootfs itself
+    def __init__(self, rootfs, mounts=None):
+        self.rootfs = rootfs
+        self.mounts = sorted((mounts or {}).items(), key=lambda x: len(x[0]), reverse=True)
+
+    def layers(self, path):
+        # host dirs of the layers of a container path upper first, and the path relative to them
+        path = os.path.normpath(os.path.join("/", path))
+        for mount, layers in self.mounts:
+            if path == mount or path.startswith(mount.rstrip("/") + "/"):
+                return [(x, os.path.relpath(path, mount)) for x in layers]
+        return [(self.rootfs, path[1:] or ".")]
+
+    @staticmethod
+    def hides(base, relpath):
+        # a deleted, replaced or opaque parent in a layer hides the path in the layers below it
+        path = base
+        for part in [x for x in os.path.dirname(relpath).split("/") if x]:
+            path = os.path.join(path, part)
+            if iswhiteout(path) or (os.path.lexists(path) and not os.path.isdir(path)):
+                return True
+            if os.path.isdir(path) and isopaque(path):
+                return True
+        return False
+
+    def realpath(self, path):
+        for base, relpath in self.layers(path):
+            layer = os.path.normpath(os.path.join(base, relpath))
+            if iswhiteout(layer):
+                return
+            if os.path.lexists(layer):
+                return layer
+            if self.hides(base, relpath):
+                return
+
+    def exists(self, path):
+        return self.realpath(path) is not None
+
+    def open(self, path, mode="rb"):
+        realpath = self.realpath(path)
+        if realpath is None:
+            raise FileNotFoundError(f"{path} does not exist in {self.rootfs}")
+        return open(realpath, mode)
+
+    def listdir(self, path):
+        fnames = set()
+        hidden = set()
+        found = False
+        for base, relpath in self.layers(path):
+            layer = os.path.normpath(os.path.join(base, relpath))
+            if iswhiteout(layer) or (os.path.lexists(layer) and not os.path.isdir(layer)):
+                break
+            if os.path.isdir(layer):
+                found = True
+                for fname in os.listdir(layer):
+                    if iswhiteout(os.path.join(layer, fname)):
+                        hidden.add(fname)
+                    elif fname not in hidden:
+                        fnames.add(fname)
+                if isopaque(layer):
+                    break
+            elif self.hides(base, relpath):
+                break
+        if not found:
+            raise FileNotFoundError(f"{path} does not exist in {self.rootfs}")
+        return sorted(fnames)
+
+    def mtime(self, path):
+        # a change in any of the layers is a change of the view
+        mtimes = []
+        for base, relpath in self.layers(path):
+            layer = os.path.normpath(os.path.join(base, relpath))
+            mtimes.append(os.stat(layer).st_mtime_ns if os.path.exists(layer) else None)
+        if not any(mtimes):
+            raise FileNotFoundError(f"{path} does not exist in {self.rootfs}")
+        return mtimes
+
+
+class Database(alpm.Database):
+    # pacman db of a container read through its view
+    def __init__(self, view, dbpath=alpm.DBPATH, conf=alpm.PACMANCONF):
+        alpm.Database.__init__(self, dbpath, conf)
+        self.view = view
+
+    def listdir(self, path):
+        return self.view.listdir(path)
+
+    def open(self, path):
+        return self.view.open(path)
+
+    def exists(self, path):
+        return self.view.exists(path)
+
+    def mtime(self, path):
+        return self.view.mtime(path)
+
+    def hostpath(self, path):
+        return self.view.realpath(path)
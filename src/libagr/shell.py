@@ -0,0 +1,145 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import queue
+import shlex
+import subprocess
+import uuid
+
+from libagr import log
+
+
+# reads framed requests from stdin and evaluates each of them in a subshell so the prelude is parsed only once
+# request: "<token> <len(cwd)> <len(env)> <len(src)>\n" followed by the payloads with the given byte lengths
+# response: output of the request followed by "<token>:dynamic <type -t pkgver>" and "<token>:end <returncode>" lines
+WORKER_LOOP = r'''
+__agr_readn() {
+    if (( $2 )); then
+        IFS= read -r -d '' -N "$2" "$1"
+    else
+        printf -v "$1" %s ""
+    fi
+}
+while IFS= read -r __agr_header; do
+    read -r __agr_token __agr_cwdlen __agr_envlen __agr_srclen <<< "$__agr_header"
+    __agr_readn __agr_cwd "$__agr_cwdlen"
+    __agr_readn __agr_env "$__agr_envlen"
+    __agr_readn __agr_src "$__agr_srclen"
+    (
+        cd "$__agr_cwd" || exit 1
+        eval "$__agr_env"
+        # a syntax error should fail the whole evaluation as it does with bash -c
+        eval "__agr_syntax() {
+$__agr_src
+}" || exit 2
+        unset -f __agr_syntax
+        eval "$__agr_src"
+        write_srcinfo
+        __agr_rc=$?
+        printf '\n%s %s\n' "$__agr_token:dynamic" "$(type -t pkgver)"
+        exit $__agr_rc
+    ) < /dev/null 2>&1
+    printf '\n%s %s\n' "$__agr_token:end" "$?"
+done
+'''
+
+
+class BashWorker:
+    def __init__(self, prelude, env):
+        self.env = env.copy()
+        # payload lengths are in bytes
+        self.env["LC_ALL"] = "C"
+        self.p = subprocess.Popen(["bash", "--noprofile", "--norc", "-c", prelude + "\n" + WORKER_LOOP],
+                                  stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT,
+                                  env=self.env)
+
+    def envscript(self, env, baseenv):
+        lines = []
+        for k, v in env.items():
+            if baseenv.get(k) != v:
+                lines.append(f"export {k}={shlex.quote(v)}")
+        for k in baseenv:
+            if k not in env:
+                lines.append(f"unset {k}")
+        if "LC_ALL" in env:
+            lines.append(f"export LC_ALL={shlex.quote(env['LC_ALL'])}")
+        else:
+            lines.append("unset LC_ALL")
+        return "\n".join(lines)
+
+    def evaluate(self, src, cwd, env, baseenv):
+        token = uuid.uuid4().hex
+        payloads = [x.encode() for x in [cwd, self.envscript(env, baseenv), src]]
+        header = f"{token} {' '.join([str(len(x)) for x in payloads])}\n".encode()
+        self.p.stdin.write(header + b"".join(payloads))
+        self.p.stdin.flush()
+
+        buf = b""
+        isdynamic = False
+        dynamicmarker = f"{token}:dynamic".encode()
+        endmarker = f"{token}:end ".encode()
+        for line in iter(self.p.stdout.readline, b""):
+            # each marker is preceded by exactly one newline of the frame, the output is kept as is
+            if line.startswith(dynamicmarker):
+                buf = buf[:-1]
+                isdynamic = line[len(dynamicmarker):].strip() != b""
+            elif line.startswith(endmarker):
+                buf = buf[:-1]
+                returncode = int(line[len(endmarker):].strip())
+                break
+            else:
+                buf += line
+        else:
+            raise OSError(f"Bash worker {self.p.pid} exited unexpectedly")
+
+        # drop the trailing newline like cmd.run_stdout does
+        output = buf.decode()
+        if output.endswith("\n"):
+            output = output[:-1]
+        if returncode != 0:
+            e = OSError(returncode)
+            log.logger.error(output)
+            e.strerror = output
+            raise e
+        return output, isdynamic
+
+    def close(self):
+        if self.p.poll() is None:
+            self.p.stdin.close()
+            self.p.wait()
+
+
+class BashPool:
+    def __init__(self, size, prelude, env):
+        self.prelude = prelude
+        self.env = env.copy()
+        self.workers = queue.Queue()
+        self.all = []
+        for _ in range(size):
+            self.workers.put(None)
+
+    def evaluate(self, src, cwd, env):
+        worker = self.workers.get()
+        try:
+            if worker is None:
+                worker = BashWorker(self.prelude, self.env)
+                self.all.append(worker)
+                log.logger.debug(f"Started bash worker {worker.p.pid}")
+            return worker.evaluate(src, cwd, env, self.env)
+        except (OSError, ValueError) as e:
+            # broken pipe or unexpected exit, the worker can not be trusted anymore
+            if worker and worker.p.poll() is not None:
+                log.logger.debug(f"Bash worker {worker.p.pid} is dead: {e}")
+                worker = None
+            raise
+        finally:
+            self.workers.put(worker)
+
+    def close(self):
+        for worker in self.all:
+            worker.close()
+        self.all = []
@@ -0,0 +1,425 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import re
+import difflib
+
+from libagr import log
+
+
+# attributes in the order makepkg's write_srcinfo emits them
+HASH_SUMS = [f"{x}sums" for x in ["ck", "md5", "sha1", "sha224", "sha256", "sha384", "sha512", "b2"]]
+GLOBAL_SINGLE = ["pkgdesc", "pkgver", "pkgrel", "epoch", "url", "install", "changelog"]
+GLOBAL_MULTI = ["arch", "groups", "license", "checkdepends", "makedepends", "depends", "optdepends",
+                "provides", "conflicts", "replaces", "noextract", "options", "backup",
+                "source", "validpgpkeys"] + HASH_SUMS
+PACKAGE_SINGLE = ["pkgdesc", "url", "install", "changelog"]
+PACKAGE_MULTI = ["arch", "groups", "license", "checkdepends", "depends", "optdepends",
+                 "provides", "conflicts", "replaces", "options", "backup"]
+ARCH_MULTI = ["source", "provides", "conflicts", "depends", "replaces", "optdepends",
+              "makedepends", "checkdepends"] + HASH_SUMS
+
+# locals of makepkg's srcinfo functions, package_*() assignments are evaluated where these shadow the globals
+SHADOWED = ["pkgname", "pkg", "attr", "attrname", "isarray", "outputvar", "outvalue", "funcname",
+            "attr_regex", "decl", "r", "shellopts", "a", "package_arch", "singlevalued", "multivalued",
+            "multivalued_arch_attrs", "REPLY"]
+
+NAME = r"[A-Za-z_][A-Za-z0-9_]*"
+RE_NAME = re.compile(NAME)
+RE_ASSIGN = re.compile(rf"^\s*({NAME})(\+?)=")
+RE_INNERASSIGN = re.compile(rf"(?:[;&|(){{}}]|\b(?:then|do|else|elif)\b)\s*({NAME})\+?=")
+RE_FUNCTION = re.compile(r"^\s*(?:function\s+([^\s(){}=$'\"]+)\s*(?:\(\s*\))?|([^\s(){}=$'\"]+)\s*\(\s*\))\s*\{")
+RE_BRACE = re.compile(r"(?:^|(?<=[\s;&|)]))([{}])(?=[\s;&|)]|$)")
+RE_HEREDOC = re.compile(r"<<(-?)\s*(['\"]?)([^\s'\";&|<>()]+)\2")
+RE_ARCHATTR = re.compile(rf"^(?:{'|'.join(ARCH_MULTI)})_\w+$")
+
+SEPERATORS = " \t\n;&|<>()"
+GLOBCHARS = "*?[{}"
+
+counter = log.Counter()
+
+
+class NotStatic(Exception):
+    pass
+
+
+class Line:
+    def __init__(self):
+        # raw text without comments, masked is the same text where quoted content is replaced with "_"
+        self.raw = []
+        self.masked = []
+        self.heredocs = []
+
+    def add(self, txt, masked=None):
+        self.raw.append(txt)
+        self.masked.append(txt if masked is None else masked * len(txt))
+
+    def finalize(self):
+        self.raw = "".join(self.raw)
+        self.masked = "".join(self.masked)
+        return self
+
+
+def splitlines(src):
+    # join the physical lines to logical lines while a quote, a parenthesis or an expansion is open
+    lines = []
+    line = Line()
+    stack = []
+    heredocs = []
+    i = 0
+    while i < len(src):
+        c = src[i]
+        top = stack[-1] if stack else None
+        quoted = top in ["'", "$'", '"', "${", "`"]
+        if top in ["'", "$'"]:
+            if c == "\\" and top == "$'":
+                line.add(src[i:i + 2], "_")
+                i += 2
+                continue
+            if c == "'":
+                stack.pop()
+            line.add(c, None if c == "'" else "_")
+            i += 1
+            continue
+        if c == "\\":
+            line.add(src[i:i + 2], "_")
+            i += 2
+            continue
+        if c == '"' and top in [None, '"', "(", "$(", "${"]:
+            if top == '"':
+                stack.pop()
+            else:
+                stack.append('"')
+            line.add(c, "_" if top == "${" else None)
+        elif c == "'" and top in [None, "(", "$(", "${"]:
+            stack.append("'")
+            line.add(c, "_" if top == "${" else None)
+        elif c == "`":
+            if top == "`":
+                stack.pop()
+            else:
+                stack.append("`")
+            line.add(c, "_" if quoted else None)
+        elif c == "$" and src[i + 1:i + 2] in ["{", "("] + ([] if top == '"' else ["'"]):
+            stack.append(c + src[i + 1])
+            line.add(src[i:i + 2], "_" if quoted or src[i + 1] != "(" else None)
+            i += 2
+            continue
+        elif c == "}" and top == "${":
+            stack.pop()
+            line.add(c, "_")
+        elif c == "(" and not quoted:
+            stack.append(c)
+            line.add(c)
+        elif c == ")" and top in ["(", "$("]:
+            stack.pop()
+            line.add(c)
+        elif c == "#" and not quoted and (not line.raw or line.raw[-1][-1] in SEPERATORS):
+            # comment till the end of the line
+            end = src.find("\n", i)
+            i = len(src) if end == -1 else end
+            continue
+        elif c == "<" and not quoted and src[i:i + 3] == "<<<":
+            line.add(src[i:i + 3])
+            i += 3
+            continue
+        elif c == "<" and not quoted and RE_HEREDOC.match(src, i):
+            match = RE_HEREDOC.match(src, i)
+            heredocs.append((match.group(3), match.group(1) == "-"))
+            line.add(match.group(0))
+            i = match.end()
+            continue
+        elif c == "\n" and not quoted and heredocs:
+            line.add(c)
+            i += 1
+            for delimiter, striptabs in heredocs:
+                body = []
+                while True:
+                    if i >= len(src):
+                        raise NotStatic(f"Unterminated heredoc {delimiter}")
+                    end = src.find("\n", i)
+                    end = len(src) if end == -1 else end
+                    docline = src[i:end]
+                    i = end + 1
+                    if (docline.lstrip("\t") if striptabs else docline) == delimiter:
+                        break
+                    body.append(docline)
+                line.heredocs.append(body)
+            heredocs = []
+            if not stack:
+                lines.append(line.finalize())
+                line = Line()
+            continue
+        elif c == "\n" and not stack:
+            lines.append(line.finalize())
+            line = Line()
+        else:
+            line.add(c, "_" if quoted and c != "\n" else None)
+        i += 1
+    if stack or heredocs:
+        raise NotStatic("Unterminated quote or expansion")
+    lines.append(line.finalize())
+    return lines
+
+
+class Evaluator:
+    def __init__(self, src):
+        self.src = src
+        self.globals = {}
+        self.functions = {}
+
+    def lookup(self, scope, name):
+        if scope is not self.globals and name in SHADOWED:
+            raise NotStatic(f"${name} is shadowed by makepkg")
+        if name not in self.globals:
+            raise NotStatic(f"${name} is not defined in PKGBUILD")
+        values = self.globals[name]
+        return values[0] if values else ""
+
+    def expand(self, scope, txt, i):
+        # txt[i] is $
+        nxt = txt[i + 1:i + 2]
+        if nxt == "{":
+            end = txt.find("}", i + 2)
+            name = txt[i + 2:end]
+            if end == -1 or not RE_NAME.fullmatch(name):
+                raise NotStatic(f"Unsupported expansion ${{{name}}}")
+            return self.lookup(scope, name), end + 1
+        match = RE_NAME.match(txt, i + 1)
+        if match:
+            return self.lookup(scope, match.group(0)), match.end()
+        if nxt and (nxt in "('\"@*#?-$!" or nxt.isdigit()):
+            raise NotStatic(f"Unsupported expansion ${nxt}")
+        return "$", i + 1
+
+    def readword(self, scope, txt, i, array):
+        # returns the value of the word, if it has any quoted part, and the position after it
+        value = ""
+        quoted = False
+        while i < len(txt):
+            c = txt[i]
+            if c in SEPERATORS:
+                break
+            elif c == "\\":
+                if txt[i + 1:i + 2] != "\n":
+                    value += txt[i + 1:i + 2]
+                    quoted = True
+                i += 2
+            elif c == "'":
+                end = txt.find("'", i + 1)
+                if end == -1:
+                    raise NotStatic("Unterminated quote")
+                value += txt[i + 1:end]
+                quoted = True
+                i = end + 1
+            elif c == '"':
+                i += 1
+                while True:
+                    if i >= len(txt):
+                        raise NotStatic("Unterminated quote")
+                    c = txt[i]
+                    if c == '"':
+                        i += 1
+                        break
+                    elif c == "\\":
+                        nxt = txt[i + 1:i + 2]
+                        if nxt in ["$", "`", '"', "\\"]:
+                            value += nxt
+                        elif nxt != "\n":
+                            value += c + nxt
+                        i += 2
+                    elif c == "$":
+                        expanded, i = self.expand(scope, txt, i)
+                        value += expanded
+                    elif c == "`":
+                        raise NotStatic("Command substitution")
+                    else:
+                        value += c
+                        i += 1
+                quoted = True
+            elif c == "$":
+                expanded, i = self.expand(scope, txt, i)
+                if array and re.search(rf"\s|[{re.escape(GLOBCHARS)}]", expanded):
+                    raise NotStatic("Unquoted expansion is subject to word splitting")
+                value += expanded
+            elif c == "`" or c == "~" or (array and c in GLOBCHARS):
+                raise NotStatic(f"Unsupported character {c}")
+            else:
+                value += c
+                i += 1
+        return value, quoted, i
+
+    def readassign(self, scope, line, match):
+        # returns name, append, isarray, values
+        txt = line.raw
+        i = match.end()
+        if txt[i:i + 1] == "(":
+            isarray = True
+            values = []
+            i += 1
+            while True:
+                while i < len(txt) and txt[i] in " \t\n":
+                    i += 1
+                if txt[i:i + 1] == ")":
+                    i += 1
+                    break
+                value, quoted, end = self.readword(scope, txt, i, True)
+                if end == i:
+                    raise NotStatic(f"Unsupported array {txt.strip()}")
+                if value or quoted:
+                    values.append(value)
+                i = end
+        else:
+            isarray = False
+            value, _quoted, i = self.readword(scope, txt, i, False)
+            values = [value]
+        if txt[i:].strip():
+            raise NotStatic(f"Unsupported statement {txt.strip()}")
+        return match.group(1), match.group(2) == "+", isarray, values
+
+    @staticmethod
+    def assign(scope, name, append, isarray, values):
+        old = list(scope.get(name, []))
+        if isarray:
+            scope[name] = old + values if append else values
+        elif not old:
+            scope[name] = values
+        elif append:
+            scope[name] = [old[0] + values[0]] + old[1:]
+        else:
+            scope[name] = values + old[1:]
+
+    def parse(self):
+        function = None
+        depth = 0
+        for line in splitlines(self.src):
+            braces = RE_BRACE.findall(line.masked)
+            if function:
+                depth += braces.count("{") - braces.count("}")
+                if depth < 0:
+                    raise NotStatic(f"Unbalanced braces in {function}")
+                self.functions[function].append(line)
+                if depth == 0:
+                    function = None
+                continue
+            if not line.masked.strip():
+                continue
+            match = RE_FUNCTION.match(line.masked)
+            if match:
+                name = match.group(1) or match.group(2)
+                self.functions[name] = [line]
+                depth = braces.count("{") - braces.count("}")
+                if depth:
+                    function = name
+                continue
+            match = RE_ASSIGN.match(line.masked)
+            if not match:
+                raise NotStatic(f"Unsupported statement {line.raw.strip()}")
+            self.assign(self.globals, *self.readassign(self.globals, line, match))
+        if function:
+            raise NotStatic(f"Unterminated function {function}")
+
+    def pkgassigns(self, pkgname):
+        # makepkg greps the lines of `declare -f package_$pkgname` starting with a known attribute
+        def istracked(name):
+            return name in PACKAGE_SINGLE or name in PACKAGE_MULTI or RE_ARCHATTR.match(name)
+
+        assigns = []
+        for line in self.functions.get(f"package_{pkgname}", []):
+            for body in line.heredocs:
+                for docline in body:
+                    match = RE_ASSIGN.match(docline)
+                    if match and istracked(match.group(1)):
+                        raise NotStatic(f"Assignment to {match.group(1)} in heredoc")
+            for match in RE_INNERASSIGN.finditer(line.masked):
+                if istracked(match.group(1)):
+                    raise NotStatic(f"Compound assignment to {match.group(1)}")
+            match = RE_ASSIGN.match(line.masked)
+            if not match or not istracked(match.group(1)):
+                continue
+            name, append, isarray, values = self.readassign({}, line, match)
+            if not isarray and not line.raw[match.end():].strip():
+                # declare -f does not print anything matching makepkg's pattern for an empty assignment
+                raise NotStatic(f"Empty assignment to {name}")
+            assigns.append((name, append, isarray, values))
+        return assigns
+
+    def extract(self, attr, isarray, assigns=None):
+        # returns None when makepkg would not write the attribute
+        if assigns is None:
+            values = self.globals.get(attr)
+            # makepkg tests only the first element with [[ $ref ]], arrays and scalars alike
+            if not values or not values[0]:
+                return
+            return values if isarray else values[:1]
+        scope = {attr: [] if isarray else [""]}
+        found = False
+        for name, append, arrayassign, values in assigns:
+            if name == attr and arrayassign == isarray:
+                found = True
+                self.assign(scope, name, append, isarray, values)
+        if found:
+            return scope[attr]
+
+    def section(self, lines, single, multi, assigns=None):
+        def write(attr, values):
+            # makepkg collapses the whitespace in values with extglob, do not depend on it
+            for value in values or [""]:
+                if re.search(r"[^\S ]| {2}", value):
+                    raise NotStatic(f"Whitespace in {attr}")
+                lines.append(f"\t{attr} = {value.strip()}")
+
+        for isarray, attrs in [(False, single), (True, multi)]:
+            for attr in attrs:
+                values = self.extract(attr, isarray, assigns)
+                if values is not None:
+                    write(attr, values)
+        for arch in self.extract("arch", True, assigns) or []:
+            if arch == "any":
+                continue
+            if not re.fullmatch(r"\w+", arch):
+                raise NotStatic(f"Unsupported arch {arch}")
+            for attr in ARCH_MULTI:
+                values = self.extract(f"{attr}_{arch}", True, assigns)
+                if values is not None:
+                    write(f"{attr}_{arch}", values)
+
+    def srcinfo(self):
+        pkgnames = self.globals.get("pkgname")
+        if not pkgnames or not pkgnames[0]:
+            raise NotStatic("pkgname is not defined")
+        pkgbase = self.globals.get("pkgbase", [""])
+        lines = [f"pkgbase = {pkgbase[0] if pkgbase and pkgbase[0] else pkgnames[0]}"]
+        self.section(lines, GLOBAL_SINGLE, GLOBAL_MULTI)
+        lines.append("")
+        for pkgname in pkgnames:
+            lines.append(f"pkgname = {pkgname}")
+            self.section(lines, PACKAGE_SINGLE, PACKAGE_MULTI, self.pkgassigns(pkgname))
+            lines.append("")
+        return "\n".join(lines)
+
+
+def evaluate(pkgsrc):
+    '''
+    Generates the srcinfo of a PKGBUILD which only consists of static assignments and function definitions,
+    without running bash. Returns the same output as (write_srcinfo, type -t pkgver) would give,
+    raises NotStatic when the PKGBUILD can not be proven to be static.
+    '''
+    evaluator = Evaluator(pkgsrc)
+    evaluator.parse()
+    return evaluator.srcinfo(), "pkgver" in evaluator.functions
+
+
+def verify(name, srcinfo, isdynamic, expected_srcinfo, expected_isdynamic, parser):
+    # differential check of the static evaluation against makepkg's write_srcinfo
+    records = [f"{k} = {v}" for k, v in parser(srcinfo)] + [f"isdynamic = {isdynamic}"]
+    expected = [f"{k} = {v}" for k, v in parser(expected_srcinfo)] + [f"isdynamic = {expected_isdynamic}"]
+    if records == expected:
+        counter.inc("verified")
+        return True
+    counter.inc("mismatch")
+    diff = difflib.unified_diff(expected, records, "write_srcinfo", "static", lineterm="")
+    log.logger.warning(f"Static srcinfo of {name} does not match makepkg:\n" + "\n".join(diff))
+    return False
@@ -0,0 +1,198 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+
+from libagr import cache
+from libagr import cmd
+from libagr import defs
+from libagr import log
+
+
+# makepkg checksum arrays that can address a file, strongest first, ck is only a crc
+HASHES = {"b2": hashlib.blake2b,
+          "sha512": hashlib.sha512,
+          "sha384": hashlib.sha384,
+          "sha256": hashlib.sha256,
+          "sha224": hashlib.sha224,
+          "sha1": hashlib.sha1,
+          "md5": hashlib.md5}
+LOCK_EXT = ".lock"
+TMP_EXT = ".tmp"
+
+
+def gitpath(url):
+    return os.path.join(defs.STORE_GIT_PATH, hashlib.sha1(url.encode()).hexdigest())
+
+
+def filepath(algo, checksum):
+    return os.path.join(defs.STORE_FILES_PATH, f"{algo}-{checksum.lower()}")
+
+
+@contextlib.contextmanager
+def locked(path):
+    # store entries are shared with the other agr processes as well
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}{LOCK_EXT}", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@cache.Cache.runonce
+def syncgit(url):
+    # one mirror per url for all the remotes and packages, fetched at most once per run when a package mirror is
+    # created from or linked to it
+    spath = gitpath(url)
+    with locked(spath):
+        if os.path.exists(spath):
+            log.logger.debug(f"Fetching shared mirror of {url}")
+            cmd.run_stdout("git", "fetch", "--all", "-p", cwd=spath, env=defs.ENV_GIT)
+        else:
+            log.logger.info(f"Creating shared mirror of {url}")
+            tmppath = f"{spath}{TMP_EXT}"
+            cmd.run_stdout("rm", "-rf", tmppath)
+            cmd.run_stdout("git", "clone", "--mirror", url, tmppath, env=defs.ENV_GIT)
+            # package mirrors may still point to objects that upstream has dropped
+            cmd.run_stdout("git", "config", "gc.pruneExpire", "never", cwd=tmppath, env=defs.ENV_GIT)
+            os.rename(tmppath, spath)
+    return spath
+
+
+def alternates(mirror):
+    path = os.path.join(mirror, "objects", "info", "alternates")
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [os.path.realpath(os.path.join(mirror, "objects", x.strip())) for x in f.read().splitlines() if x.strip()]
+
+
+def linkgit(url, mirror):
+    # the package mirror borrows the objects of the shared mirror, and makepkg fetches only its refs into it
+    if os.path.exists(mirror) and os.path.realpath(os.path.join(gitpath(url), "objects")) in alternates(mirror):
+        # makepkg fetches the linked mirror itself, fetching the shared one too would fetch twice
+        return
+    objects = os.path.join(syncgit(url), "objects")
+    if not os.path.exists(mirror):
+        cmd.run_stdout("git", "clone", "--mirror", "--shared", os.path.dirname(objects), mirror, env=defs.ENV_GIT)
+        cmd.run_stdout("git", "remote", "set-url", "origin", url, cwd=mirror, env=defs.ENV_GIT)
+    elif os.path.realpath(objects) not in alternates(mirror):
+        log.logger.info(f"Moving objects of {mirror} to the shared mirror of {url}")
+        with open(os.path.join(mirror, "objects", "info", "alternates"), "a") as f:
+            f.write(f"{objects}\n")
+        # drop the objects that are now in the shared mirror
+        cmd.run_stdout("git", "repack", "-a", "-d", "-l", "-q", cwd=mirror, env=defs.ENV_GIT)
+
+
+def hashfile(path, algo):
+    digest = HASHES[algo]()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def replace(src, dst):
+    # dst becomes a hardlink of src, or a reflink copy when they are not on the same filesystem
+    tmppath = f"{dst}.{os.getpid()}{TMP_EXT}"
+    try:
+        os.link(src, tmppath)
+    except OSError:
+        cmd.run_stdout("cp", "--reflink=auto", src, tmppath)
+    os.replace(tmppath, dst)
+
+
+def readrefs(srcpath):
+    # store entries of the files in a source dir, by file name
+    try:
+        with open(os.path.join(srcpath, defs.STOREREFS), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def reference(path, spath):
+    # reflinks and plain copies have no link count to tell that they use an entry, so the source dir lists them
+    srcpath, fname = os.path.split(path)
+    refs = readrefs(srcpath)
+    if refs.get(fname) == os.path.basename(spath):
+        return
+    refs[fname] = os.path.basename(spath)
+    refspath = os.path.join(srcpath, defs.STOREREFS)
+    tmppath = f"{refspath}.{os.getpid()}{TMP_EXT}"
+    with open(tmppath, "w") as f:
+        json.dump(refs, f)
+    os.replace(tmppath, refspath)
+
+
+def linkfile(path, algo, checksum):
+    # returns True if the file is served from the store
+    spath = filepath(algo, checksum)
+    if os.path.exists(path) or not os.path.exists(spath):
+        return False
+    log.logger.debug(f"Linking {path} from {spath}")
+    replace(spath, path)
+    reference(path, spath)
+    return True
+
+
+def addfile(path, algo, checksum):
+    # a downloaded file goes to the store only if it matches its checksum, the store is addressed by it
+    spath = filepath(algo, checksum)
+    if not os.path.isfile(path):
+        return
+    if os.path.exists(spath) and os.path.samefile(path, spath):
+        reference(path, spath)
+        return
+    if hashfile(path, algo) != checksum.lower():
+        log.logger.debug(f"Not storing {path}, {algo} checksum does not match")
+        return
+    with locked(spath):
+        if os.path.exists(spath):
+            log.logger.debug(f"Linking duplicate {path} from {spath}")
+            replace(spath, path)
+        else:
+            log.logger.debug(f"Storing {path} as {spath}")
+            replace(path, spath)
+        reference(path, spath)
+
+
+def gc():
+    # files are referenced by the refs of the package folders as long as the files are still there, git mirrors
+    # by the alternates of the package mirrors, an entry without any reference is removed
+    referenced = set()
+    files = set()
+    for remote in os.listdir(defs.SRC_PATH) if os.path.exists(defs.SRC_PATH) else []:
+        rpath = os.path.join(defs.SRC_PATH, remote)
+        if remote == defs.STORE_NAME or not os.path.isdir(rpath):
+            continue
+        for pkg in os.listdir(rpath):
+            ppath = os.path.join(rpath, pkg)
+            if not os.path.isdir(ppath):
+                continue
+            for fname, name in readrefs(ppath).items():
+                if os.path.isfile(os.path.join(ppath, fname)):
+                    files.add(name)
+            for mirror in os.listdir(ppath):
+                referenced.update(alternates(os.path.join(ppath, mirror)))
+    for basepath, isref in [(defs.STORE_GIT_PATH, lambda p: os.path.realpath(os.path.join(p, "objects")) in referenced),
+                            (defs.STORE_FILES_PATH, lambda p: os.path.basename(p) in files)]:
+        if not os.path.exists(basepath):
+            continue
+        for fname in os.listdir(basepath):
+            path = os.path.join(basepath, fname)
+            if fname.endswith(LOCK_EXT):
+                # it is gone already if its entry was cleaned before it
+                if os.path.exists(path) and not os.path.exists(path[:-len(LOCK_EXT)]):
+                    os.remove(path)
+            elif fname.endswith(TMP_EXT) or not isref(path):
+                log.logger.info(f"Cleaning unreferenced {path}")
+                cmd.run_stdout("rm", "-rf", path, f"{path}{LOCK_EXT}")
@@ -0,0 +1,107 @@
+'''
+Created on Oct 18, 2026
+
+@author: boogie
+'''
+import os
+import threading
+
+from libagr import defs
+from libagr import log
+
+
+# footprints grow from one build to the next, leave some room
+MARGIN = 1.25
+
+lock = threading.Lock()
+current = None
+
+
+def fstype(path):
+    # type of the filesystem the path is on, the longest mount point containing it wins
+    path = os.path.realpath(path)
+    found = None, ""
+    try:
+        with open("/proc/mounts", "r") as f:
+            for line in f.read().splitlines():
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount = parts[1].replace("\\040", " ")
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) > len(found[1]):
+                    found = parts[2], mount
+    except OSError:
+        pass
+    return found[0]
+
+
+def readfootprint(path):
+    try:
+        with open(path, "r") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return
+
+
+def writefootprint(path, size):
+    log.logger.debug(f"Write footprint {path}: {log.sizeof(size)}")
+    with open(path, "w") as f:
+        f.write(str(size))
+
+
+class Budget:
+    # RAM on tmpfs that the throwaway files of the builds in a run can use, a build goes to tmpfs only if its footprint
+    # is known from a previous build and fits, everything else is on the disk as before
+    def __init__(self, size, path=defs.TMPFS_PATH):
+        self.size = size
+        self.path = path
+        self.used = 0
+        self.saved = 0
+
+    def free(self):
+        st = os.statvfs(self.path)
+        return st.f_bavail * st.f_frsize
+
+    def reserve(self, footprint):
+        # returns the reserved bytes, 0 if the footprint does not fit
+        if not footprint or not self.size:
+            return 0
+        need = int(footprint * MARGIN)
+        with lock:
+            if self.used + need > self.size or need > self.free():
+                log.logger.debug(f"Footprint {log.sizeof(need)} does not fit in tmpfs, "
+                                 f"{log.sizeof(self.size - self.used)} of budget left")
+                return 0
+            self.used += need
+        return need
+
+    def release(self, reserved, kept=0):
+        with lock:
+            self.used -= reserved
+            self.saved += kept
+
+    def __enter__(self):
+        global current
+        if self.size:
+            os.makedirs(self.path, exist_ok=True)
+            if fstype(self.path) != "tmpfs":
+                log.logger.warning(f"{self.path} is not on tmpfs, building on the disk")
+                self.size = 0
+        with lock:
+            current = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        global current
+        with lock:
+            current = None
+        if self.saved:
+            log.logger.info(f"Kept {log.sizeof(self.saved)} of build files off the disk on tmpfs")
+        return False
+
+
+def budget():
+    # budget of the running builds, None if they are not run under one
+    with lock:
+        if current is not None and current.size:
+            return current